@@ -1,24 +1,64 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, send_file
 import io
 import base64
 import json
 from datetime import datetime
 import os
 from flask_cors import CORS
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image, ImageDraw, ImageFont, features
 import random
+import math
+import functools
+import hashlib
+import time
+import zipfile
+import mmap
+import sqlite3
+import tempfile
+import bisect
+import stat
+import string
+from contextlib import contextmanager
+from collections import OrderedDict, deque, namedtuple
+from types import MappingProxyType
+from xml.sax.saxutils import escape
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import threading
+import sys
+
+try:
+    import fcntl
+except ImportError:
+    # No flock on this platform, renders are only coalesced within a process
+    fcntl = None
+
+try:
+    import resource
+except ImportError:
+    # Peak RSS is not reported on this platform
+    resource = None
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
 
+# Supported currencies: display name, ticker symbol, logo icon and the theme color of the icon
+Currency = namedtuple('Currency', ('code', 'name', 'symbol', 'icon', 'color'))
+
+# Currency registry, built once at import and read-only afterwards
+CURRENCIES = MappingProxyType({currency.code: currency for currency in (
+    Currency('btc', 'Bitcoin', 'BTC', '₿', 'primary'),
+    Currency('eth', 'Ethereum', 'ETH', 'Ξ', 'primary'),
+    Currency('usdt', 'Tether', 'USDT', '₮', 'primary'),
+    Currency('sol', 'Solana', 'SOL', 'S', 'primary'),
+    Currency('bnb', 'Binance Coin', 'BNB', 'B', 'primary'),
+)})
+
+# Used for any currency code that is not in the registry, the symbol is the uppercased code
+UNKNOWN_CURRENCY = Currency(None, 'Cryptocurrency', None, 'Ð', 'primary')
+
 # Cryptocurrency icons (Unicode symbols)
-CRYPTO_ICONS = {
-    'btc': '₿',
-    'eth': 'Ξ',
-    'usdt': '₮',
-    'sol': 'S',
-    'bnb': 'B',
-}
+CRYPTO_ICONS = MappingProxyType({code: currency.icon for code, currency in CURRENCIES.items()})
 
 # Colors for a more professional look
 COLORS = {
@@ -33,311 +73,2301 @@ COLORS = {
     'error': (239, 68, 68),          # Red for errors
 }
 
+# Histogram bucket upper bounds for stage timings (seconds) and output sizes (bytes)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+SIZE_BUCKETS = (1024, 4096, 16384, 32768, 65536, 131072, 262144, 524288, 1048576)
+
+class Metrics:
+    """
+    In-process counters and histograms, exposed in the Prometheus text format
+    
+    Values are kept per process, so each gunicorn worker reports its own.
+    Renders on the process pool executor only show up as the 'render' stage.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+        self._help = {}
+    
+    def describe(self, name, kind, help_text):
+        """Registers the TYPE and HELP lines of a metric"""
+        self._help[name] = (kind, help_text)
+    
+    def inc(self, name, labels=None, value=1):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+    
+    def observe(self, name, value, labels=None, buckets=LATENCY_BUCKETS):
+        key = (name, tuple(sorted(labels.items())) if labels else ())
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [buckets, [0] * (len(buckets) + 1), 0.0, 0]
+            histogram[1][bisect.bisect_left(buckets, value)] += 1
+            histogram[2] += value
+            histogram[3] += 1
+    
+    def reset(self):
+        """Drops every recorded value, keeping the metric descriptions"""
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+    
+    def observe_stage(self, stage, seconds):
+        self.observe('contract_stage_seconds', seconds, {'stage': stage})
+    
+    @contextmanager
+    def time(self, stage):
+        """Times the enclosed block as a render stage"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe_stage(stage, time.perf_counter() - started)
+    
+    def render(self, extra=()):
+        """
+        Renders every metric in the Prometheus text exposition format
+        
+        Args:
+            extra (iterable): (name, kind, help, labels, value) samples computed at scrape time
+        """
+        with self._lock:
+            counters = sorted(self._counters.items())
+            histograms = sorted((key, (h[0], list(h[1]), h[2], h[3])) for key, h in self._histograms.items())
+        
+        lines = []
+        described = set()
+        
+        def header(name, kind, help_text=None):
+            if name not in described:
+                described.add(name)
+                kind, help_text = self._help.get(name, (kind, help_text or name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} {kind}")
+        
+        for (name, labels), value in counters:
+            header(name, 'counter')
+            lines.append(f"{name}{format_labels(labels)} {value}")
+        for name, kind, help_text, labels, value in extra:
+            header(name, kind, help_text)
+            lines.append(f"{name}{format_labels(tuple(sorted(labels.items())))} {value}")
+        for (name, labels), (buckets, counts, total, count) in histograms:
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else f"{bound:g}"
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {total:.6f}")
+            lines.append(f"{name}_count{format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+def format_labels(labels):
+    """Formats (name, value) pairs as a Prometheus label set"""
+    if not labels:
+        return ''
+    pairs = []
+    for name, value in labels:
+        value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        pairs.append(f'{name}="{value}"')
+    return '{' + ','.join(pairs) + '}'
+
+metrics = Metrics()
+metrics.describe('contract_stage_seconds', 'histogram', 'Time spent in each request and render stage')
+metrics.describe('contract_output_bytes', 'histogram', 'Size of encoded contract images')
+metrics.describe('contract_request_seconds', 'histogram', 'Request latency by endpoint')
+metrics.describe('contract_requests_total', 'counter', 'Requests by endpoint and status')
+metrics.describe('contract_errors_total', 'counter', 'Contract errors by exception type')
+metrics.describe('contract_template_cache_total', 'counter', 'Static template lookups by result')
+metrics.describe('contract_coalesced_total', 'counter', 'Renders shared with an identical request in flight, by scope')
+
+# Font files tried in order when FONT_PATH is not set
+FONT_CANDIDATES = ("arial.ttf", "DejaVuSans.ttf")
+
+# Maximum number of loaded (path, size) font objects kept in memory
+FONT_CACHE_SIZE = int(os.environ.get('FONT_CACHE_SIZE', 32))
+
+def resolve_font_path():
+    """
+    Finds the first usable TrueType font file
+    Returns None when only the default bitmap font is available
+    """
+    candidates = list(FONT_CANDIDATES)
+    if os.environ.get('FONT_PATH'):
+        candidates.insert(0, os.environ['FONT_PATH'])
+    for candidate in candidates:
+        try:
+            font = ImageFont.truetype(candidate, 12)
+        except IOError:
+            continue
+        # Pillow searches the system font directories, keep the path it found
+        return getattr(font, 'path', candidate)
+    return None
+
+# Resolved once at import so requests never search the filesystem for fonts
+RESOLVED_FONT_PATH = resolve_font_path()
+
+@functools.lru_cache(maxsize=FONT_CACHE_SIZE)
+def load_font(path, size):
+    """Loads a font object, cached by (path, size)"""
+    if path is None:
+        return ImageFont.load_default()
+    return ImageFont.truetype(path, size)
+
 def get_better_font(size=12):
     """
     Attempt to get a better font than the default
     Falls back to default if necessary
     """
-    try:
-        # Try to use a nicer built-in font
-        return ImageFont.truetype("arial.ttf", size)
-    except IOError:
-        try:
-            return ImageFont.truetype("DejaVuSans.ttf", size)
-        except IOError:
-            # Fall back to default font
-            return ImageFont.load_default()
+    return load_font(RESOLVED_FONT_PATH, size)
+
+def font_cache_stats():
+    """Returns the font cache hit/miss counters"""
+    info = load_font.cache_info()
+    return {
+        "path": RESOLVED_FONT_PATH,
+        "hits": info.hits,
+        "misses": info.misses,
+        "size": info.currsize,
+        "max_size": info.maxsize
+    }
+
+# Maximum number of rasterized text runs kept in memory
+TEXT_CACHE_SIZE = int(os.environ.get('TEXT_CACHE_SIZE', 512))
 
-def create_contract_image(payment_data):
+# Scratch drawing context used only to measure text
+_measure_draw = ImageDraw.Draw(Image.new('L', (1, 1)))
+
+@functools.lru_cache(maxsize=TEXT_CACHE_SIZE)
+def text_width(text, font):
+    """Measures the advance width of a text run, cached by (text, font)"""
+    return _measure_draw.textlength(text, font=font)
+
+class TextRunCache:
     """
-    Creates a visually appealing contract image based on payment data
+    LRU cache of rasterized text runs
+    
+    Each run is drawn once into an 8-bit alpha mask and pasted with the
+    requested fill afterwards, so the mask does not depend on the color.
+    The fractional part of the position is part of the key because
+    FreeType renders sub-pixel offsets differently.
+    """
+    
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get_mask(self, text, font, fraction):
+        """Returns (mask image, (dx, dy) offset of the mask from the integer position)"""
+        key = (text, font, fraction)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry
+            self.misses += 1
+        
+        entry = rasterize_text(text, font, fraction)
+        with self._lock:
+            self._entries[key] = entry
+            if len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entry
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+def rasterize_text(text, font, fraction):
+    """
+    Draws a text run into a tightly cropped alpha mask
     
     Args:
-        payment_data (dict): Contains amount, sender, receiver, date, time, and cryptocurrency type
+        text (str): Text to draw
+        font (FreeTypeFont): Font to draw with
+        fraction (tuple): Sub-pixel (x, y) offset of the run
         
     Returns:
-        bytes: Base64 encoded PNG image
+        tuple: (L mode mask, (dx, dy) offset of the mask from the integer position)
     """
-    # Extract payment data
-    amount = payment_data.get('amount', 0)
-    sender = payment_data.get('sender', 'Unknown')
-    receiver = payment_data.get('receiver', 'Unknown')
-    timestamp = payment_data.get('timestamp', datetime.now().isoformat())
-    currency_type = payment_data.get('currency', 'btc').lower()
-    currency_name = payment_data.get('currencyName', 'Bitcoin')
-    currency_symbol = payment_data.get('currencySymbol', 'BTC')
+    left, top, right, bottom = font.getbbox(text)
+    pad_x = max(0, -math.floor(left)) + 1
+    pad_y = max(0, -math.floor(top)) + 1
+    mask = Image.new('L', (math.ceil(right) + pad_x + 2, math.ceil(bottom) + pad_y + 2), 0)
+    ImageDraw.Draw(mask).text((pad_x + fraction[0], pad_y + fraction[1]), text, font=font, fill=255)
+    bbox = mask.getbbox()
+    if bbox is None:
+        return mask.crop((0, 0, 0, 0)), (0, 0)
+    return mask.crop(bbox), (bbox[0] - pad_x, bbox[1] - pad_y)
+
+text_cache = TextRunCache(TEXT_CACHE_SIZE)
+
+def draw_text(image, xy, text, font, fill):
+    """
+    Draws a text run like ImageDraw.text, pasting a cached mask of it
     
-    # Format addresses for display (show only first 6 and last 4 characters)
-    def format_address(address):
-        if len(address) > 10:
-            return f"{address[:6]}...{address[-4:]}"
-        return address
+    Args:
+        image (Image): RGBA image to draw on
+        xy (tuple): Top-left position, as for ImageDraw.text
+        text (str): Text to draw
+        font: Font to draw with; non-TrueType fonts and runs starting
+            off the canvas are drawn directly
+        fill (tuple): RGB or RGBA text color
+    """
+    x, y = xy
+    if not isinstance(font, ImageFont.FreeTypeFont) or x < 0 or y < 0:
+        ImageDraw.Draw(image).text(xy, text, font=font, fill=fill)
+        return
+    ix, iy = int(x), int(y)
+    mask, (dx, dy) = text_cache.get_mask(text, font, (x - ix, y - iy))
+    if mask.width and mask.height:
+        image.paste(fill, (ix + dx, iy + dy, ix + dx + mask.width, iy + dy + mask.height), mask)
+
+# Themes for the static contract layers (only the default palette for now)
+THEMES = {
+    'default': COLORS,
+}
+
+# Pre-rendered static contract layers, keyed by (currency, size, theme, mode).
+# Templates at the preset sizes are kept for good, any other size goes to a
+# least recently used cache capped at TEMPLATE_CACHE_BYTES of pixel data.
+TEMPLATE_CACHE_BYTES = int(os.environ.get('TEMPLATE_CACHE_BYTES', 64 * 1024 * 1024))
+_template_cache = {}
+_sized_template_cache = OrderedDict()
+_sized_template_bytes = 0
+_template_lock = threading.Lock()
+
+# Canvas size at scale 1.0, every layout coordinate is given at this size
+BASE_WIDTH, BASE_HEIGHT = 900, 600
+
+# Allowed range for the render scale
+MIN_RENDER_SCALE = 0.1
+MAX_RENDER_SCALE = 3.0
+
+# Named render sizes for the size parameter
+SIZE_PRESETS = {
+    'thumbnail': 0.25,
+    'small': 0.5,
+    'full': 1.0,
+    'large': 2.0,
+}
+
+# Other sizes are rounded to a multiple of this width, so they share templates
+RENDER_WIDTH_STEP = 50
+
+# Encoder preset used for thumbnails unless the request picks one
+THUMBNAIL_OUTPUT_PRESET = 'fast'
+
+def canvas_size(scale=1.0):
+    """Returns the (width, height) of a contract rendered at the given scale"""
+    return (round(BASE_WIDTH * scale), round(BASE_HEIGHT * scale))
+
+# Canvas sizes whose templates are never evicted
+PRESET_CANVAS_SIZES = frozenset(canvas_size(scale) for scale in SIZE_PRESETS.values())
+
+def render_scale(size=None, scale=None):
+    """
+    Resolves the render scale from a size preset, a pixel width or an explicit scale
     
-    sender_formatted = format_address(sender)
-    receiver_formatted = format_address(receiver)
+    Scales that are not a preset are snapped so the width is a multiple of
+    RENDER_WIDTH_STEP pixels, which keeps the number of distinct templates small.
     
-    # Generate a unique transaction ID
-    tx_id = ''.join(random.choice('0123456789abcdef') for _ in range(16))
+    Args:
+        size (str): Name in SIZE_PRESETS or an output width in pixels
+        scale (float): Scale relative to the 900x600 base size
+        
+    Returns:
+        float: Render scale
+        
+    Raises:
+        ValueError: If both are given, the size is unknown or the scale is out of range
+    """
+    if size is not None and scale is not None:
+        raise ValueError("Use either size or scale, not both")
+    if size is not None:
+        if size in SIZE_PRESETS:
+            scale = SIZE_PRESETS[size]
+        else:
+            try:
+                scale = int(size) / BASE_WIDTH
+            except ValueError:
+                raise ValueError(f"Unknown size: {size}") from None
+    if scale is None:
+        return 1.0
+    if not MIN_RENDER_SCALE <= scale <= MAX_RENDER_SCALE:
+        raise ValueError(f"Scale must be between {MIN_RENDER_SCALE:g} and {MAX_RENDER_SCALE:g}")
+    if scale not in SIZE_PRESETS.values():
+        steps = max(1, round(BASE_WIDTH * scale / RENDER_WIDTH_STEP))
+        scale = steps * RENDER_WIDTH_STEP / BASE_WIDTH
+    return scale
+
+def contract_layout(width, height):
+    """
+    Computes the positions shared by the static template and the per-request text
     
-    # Parse timestamp
-    try:
-        dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-        date_str = dt.strftime('%b %d, %Y')
-        time_str = dt.strftime('%I:%M %p')
-    except (ValueError, TypeError):
-        date_str = "Unknown Date"
-        time_str = "Unknown Time"
+    Coordinates are scaled from the 900x600 base layout to the canvas width.
     
-    # Create image with higher resolution
-    width, height = 900, 600
-    image = Image.new('RGBA', (width, height), color=(0, 0, 0, 0))
+    Args:
+        width (int): Canvas width in pixels
+        height (int): Canvas height in pixels
+        
+    Returns:
+        dict: Named coordinates and sizes for the contract layout
+    """
+    scale = width / BASE_WIDTH
+    
+    def px(value):
+        return round(value * scale)
+    
+    header_height = px(100)
+    line_y = header_height + px(40)
+    amount_y = line_y + px(60)
+    amount_box_height = px(100)
+    info_y = amount_y + amount_box_height + px(30)
+    verify_y = info_y + px(190)
+    return {
+        'width': width,
+        'height': height,
+        'scale': scale,
+        'px': px,
+        'header_height': header_height,
+        'circle_size': px(60),
+        'circle_pos': (px(50), px(50)),
+        'line_y': line_y,
+        'amount_y': amount_y,
+        'amount_box_height': amount_box_height,
+        'info_y': info_y,
+        'verify_y': verify_y,
+        'seal_size': px(80),
+        'seal_x': width - px(120),
+        'seal_y': verify_y + px(20),
+        'footer_y': height - px(40),
+    }
+
+def scaled_font(layout, size):
+    """Returns the font for a base-layout font size at the layout's scale"""
+    return get_better_font(max(1, layout['px'](size)))
+
+def build_gradient_background(size, strength=0.4):
+    """
+    Builds the white background layer whose opacity fades from top to bottom
     
-    # Create a rounded rectangle background
-    background = Image.new('RGBA', (width, height), color=(0, 0, 0, 0))
-    bg_draw = ImageDraw.Draw(background)
+    The gradient covers the whole canvas, so it is the complete background layer.
     
-    # Draw a rounded rectangle (simulated with multiple shapes)
-    radius = 20
-    bg_draw.rectangle([(radius, 0), (width - radius, height)], fill=COLORS['light'])
-    bg_draw.rectangle([(0, radius), (width, height - radius)], fill=COLORS['light'])
-    bg_draw.pieslice([(0, 0), (radius * 2, radius * 2)], 180, 270, fill=COLORS['light'])
-    bg_draw.pieslice([(width - radius * 2, 0), (width, radius * 2)], 270, 360, fill=COLORS['light'])
-    bg_draw.pieslice([(0, height - radius * 2), (radius * 2, height)], 90, 180, fill=COLORS['light'])
-    bg_draw.pieslice([(width - radius * 2, height - radius * 2), (width, height)], 0, 90, fill=COLORS['light'])
+    Args:
+        size (tuple): Canvas (width, height) in pixels
+        strength (float): Fraction of the opacity lost at the bottom edge
+        
+    Returns:
+        Image: RGBA background layer
+    """
+    width, height = size
+    # One column of opacities, stretched across the width in a single resize
+    column = bytes(int(255 * (1 - y / height * strength)) for y in range(height))
+    alpha = Image.frombytes('L', (1, height), column).resize((width, height), Image.NEAREST)
+    background = Image.new('RGBA', (width, height), (255, 255, 255, 0))
+    background.putalpha(alpha)
+    return background
+
+def build_header_background(size, color, stripe_spacing=20, stripe_width=5, stripe_shift=10):
+    """
+    Builds the header layer with translucent diagonal stripes
+    
+    Args:
+        size (tuple): Header (width, height) in pixels
+        color (tuple): RGB header color
+        stripe_spacing (int): Horizontal distance between stripes
+        stripe_width (int): Stripe width in pixels
+        stripe_shift (float): Horizontal offset of a stripe from top to bottom
+        
+    Returns:
+        Image: RGBA header layer
+    """
+    width, height = size
+    # Vertical stripes, one row repeated down the header, then sheared in a single transform
+    row = bytes(255 if (x + stripe_width // 2) % stripe_spacing < stripe_width else 0
+                for x in range(width + stripe_spacing))
+    stripes = Image.frombytes('L', (width + stripe_spacing, 1), row).resize((width + stripe_spacing, height), Image.NEAREST)
+    mask = stripes.transform((width, height), Image.AFFINE,
+                             (1, -stripe_shift / height, stripe_spacing, 0, 1, 0), Image.NEAREST)
+    header_bg = Image.new('RGBA', (width, height), color)
+    header_bg.paste((255, 255, 255, 10), (0, 0), mask)
+    return header_bg
+
+def build_contract_template(currency_type, size=(900, 600), theme='default'):
+    """
+    Draws every part of the contract that is the same for all payments in a currency:
+    background, header, logo, fixed labels, seal and footer
+    
+    Args:
+        currency_type (str): Lowercase currency code, used for the logo icon
+        size (tuple): Canvas (width, height) in pixels, the layout scales with the width
+        theme (str): Name of the color theme in THEMES
+        
+    Returns:
+        Image: RGBA template to copy and draw the payment details onto
+    """
+    colors = THEMES[theme]
+    width, height = size
+    layout = contract_layout(width, height)
+    px = layout['px']
+    line_width = max(1, px(1))
+    image = Image.new('RGBA', (width, height), color=(0, 0, 0, 0))
     
-    # Add a subtle gradient overlay
-    for y in range(height):
-        opacity = int(255 * (1 - y / height * 0.4))
-        bg_draw.line([(0, y), (width, y)], fill=(255, 255, 255, opacity))
+    # White background fading towards the bottom
+    background = build_gradient_background((width, height))
     
     # Paste background onto main image
     image.paste(background, (0, 0), background)
     draw = ImageDraw.Draw(image)
     
-    # Get better fonts
-    title_font = get_better_font(32)
-    header_font = get_better_font(24)
-    regular_font = get_better_font(20)
-    small_font = get_better_font(16)
-    tiny_font = get_better_font(12)
-    icon_font = get_better_font(36)
-    
-    # Draw header background
-    header_height = 100
-    header_bg = Image.new('RGBA', (width, header_height), COLORS['primary'])
-    header_draw = ImageDraw.Draw(header_bg)
-    
-    # Add subtle header pattern
-    for i in range(0, width, 20):
-        header_draw.line([(i, 0), (i + 10, header_height)], fill=(255, 255, 255, 10), width=5)
+    title_font = scaled_font(layout, 32)
+    header_font = scaled_font(layout, 24)
+    small_font = scaled_font(layout, 16)
+    tiny_font = scaled_font(layout, 12)
+    icon_font = scaled_font(layout, 36)
+    
+    # Draw header background with a subtle diagonal stripe pattern
+    header_height = layout['header_height']
+    header_bg = build_header_background((width, header_height), colors['primary'],
+                                        stripe_spacing=max(2, px(20)), stripe_width=max(1, px(5)),
+                                        stripe_shift=px(10))
     
     # Paste header background
     image.paste(header_bg, (0, 0), header_bg)
     
     # Draw blockchain logo circle in top left
-    circle_size = 60
-    circle_pos = (50, 50)
+    circle_size = layout['circle_size']
+    circle_pos = layout['circle_pos']
     draw.ellipse([(circle_pos[0] - circle_size//2, circle_pos[1] - circle_size//2), 
                  (circle_pos[0] + circle_size//2, circle_pos[1] + circle_size//2)], 
                  fill=(255, 255, 255))
     
     # Draw cryptocurrency icon in the circle
-    icon = CRYPTO_ICONS.get(currency_type, 'Ð')
-    icon_w = draw.textlength(icon, font=icon_font)
-    draw.text((circle_pos[0] - icon_w/2, circle_pos[1] - 18), icon, font=icon_font, fill=COLORS['primary'])
+    currency = CURRENCIES.get(currency_type, UNKNOWN_CURRENCY)
+    icon_w = draw.textlength(currency.icon, font=icon_font)
+    draw.text((circle_pos[0] - icon_w/2, circle_pos[1] - px(18)), currency.icon, font=icon_font, fill=colors[currency.color])
     
     # Draw title
-    draw.text((circle_pos[0] + circle_size//2 + 20, 30), "Payment Contract", font=title_font, fill=(255, 255, 255))
-    draw.text((circle_pos[0] + circle_size//2 + 20, 70), f"{date_str} · {time_str}", font=small_font, fill=(220, 255, 220))
+    draw.text((circle_pos[0] + circle_size//2 + px(20), px(30)), "Payment Contract", font=title_font, fill=(255, 255, 255))
     
     # Draw "BLOCKCHAIN BASED CONTRACT" at top right
     blockchain_text = "BLOCKCHAIN BASED CONTRACT"
     blockchain_w = draw.textlength(blockchain_text, font=small_font)
-    draw.text((width - blockchain_w - 30, 30), blockchain_text, font=small_font, fill=(255, 255, 255))
+    draw.text((width - blockchain_w - px(30), px(30)), blockchain_text, font=small_font, fill=(255, 255, 255))
     
     # Draw decorative horizontal lines
-    line_y = header_height + 40
-    draw.line([(50, line_y), (width-50, line_y)], fill=COLORS['muted'], width=1)
-    
-    # Draw transaction ID
-    draw.text((50, line_y + 15), f"Transaction ID: {tx_id}", font=tiny_font, fill=COLORS['muted'])
+    line_y = layout['line_y']
+    draw.line([(px(50), line_y), (width - px(50), line_y)], fill=colors['muted'], width=line_width)
     
     # Draw security badge
     badge_text = "BLOCKCHAIN SECURED"
     badge_w = draw.textlength(badge_text, font=tiny_font)
-    badge_x = width - badge_w - 50
-    draw.text((badge_x, line_y + 15), badge_text, font=tiny_font, fill=COLORS['success'])
+    badge_x = width - badge_w - px(50)
+    draw.text((badge_x, line_y + px(15)), badge_text, font=tiny_font, fill=colors['success'])
     
     # Draw amount section with a highlight box
-    amount_y = line_y + 60
-    amount_box_height = 100
-    amount_box = Image.new('RGBA', (width - 100, amount_box_height), (240, 253, 244))
-    image.paste(amount_box, (50, amount_y), amount_box)
-    
-    draw.text((70, amount_y + 15), "Amount", font=header_font, fill=COLORS['secondary'])
+    amount_y = layout['amount_y']
+    amount_box = Image.new('RGBA', (width - px(100), layout['amount_box_height']), (240, 253, 244))
+    image.paste(amount_box, (px(50), amount_y), amount_box)
     
-    # Draw amount with currency symbol
-    amount_text = f"{amount} {currency_symbol}"
-    draw.text((70, amount_y + 50), amount_text, font=title_font, fill=COLORS['primary'])
-    
-    # Draw currency name
-    currency_text = f"({currency_name})"
-    amount_w = draw.textlength(amount_text, font=title_font)
-    draw.text((80 + amount_w, amount_y + 55), currency_text, font=regular_font, fill=COLORS['muted'])
-    
-    # Draw sender and receiver information
-    info_y = amount_y + amount_box_height + 30
+    draw.text((px(70), amount_y + px(15)), "Amount", font=header_font, fill=colors['secondary'])
     
-    # From section
-    draw.text((70, info_y), "From", font=header_font, fill=COLORS['secondary'])
-    draw.text((70, info_y + 40), sender_formatted, font=regular_font, fill=COLORS['dark'])
-    
-    # To section
-    draw.text((70, info_y + 90), "To", font=header_font, fill=COLORS['secondary'])
-    draw.text((70, info_y + 130), receiver_formatted, font=regular_font, fill=COLORS['dark'])
+    # Sender and receiver labels
+    info_y = layout['info_y']
+    draw.text((px(70), info_y), "From", font=header_font, fill=colors['secondary'])
+    draw.text((px(70), info_y + px(90)), "To", font=header_font, fill=colors['secondary'])
     
     # Draw verification section
-    verify_y = info_y + 190
-    draw.line([(50, verify_y), (width-50, verify_y)], fill=COLORS['muted'], width=1)
+    verify_y = layout['verify_y']
+    draw.line([(px(50), verify_y), (width - px(50), verify_y)], fill=colors['muted'], width=line_width)
     
     # Add verification seal
-    seal_size = 80
-    seal_x = width - 120
-    seal_y = verify_y + 20
+    seal_size = layout['seal_size']
+    seal_x = layout['seal_x']
+    seal_y = layout['seal_y']
     
     # Draw seal background
     draw.ellipse([(seal_x - seal_size//2, seal_y - seal_size//2), 
                  (seal_x + seal_size//2, seal_y + seal_size//2)], 
-                 outline=COLORS['success'], width=2)
+                 outline=colors['success'], width=max(1, px(2)))
     
     # Draw inner circles for seal decoration
-    draw.ellipse([(seal_x - seal_size//2 + 10, seal_y - seal_size//2 + 10), 
-                 (seal_x + seal_size//2 - 10, seal_y + seal_size//2 - 10)], 
-                 outline=COLORS['success'], width=1)
+    draw.ellipse([(seal_x - seal_size//2 + px(10), seal_y - seal_size//2 + px(10)), 
+                 (seal_x + seal_size//2 - px(10), seal_y + seal_size//2 - px(10))], 
+                 outline=colors['success'], width=line_width)
     
     # Add checkmark in seal
-    draw.text((seal_x - 10, seal_y - 20), "✓", font=get_better_font(40), fill=COLORS['success'])
+    draw.text((seal_x - px(10), seal_y - px(20)), "✓", font=scaled_font(layout, 40), fill=colors['success'])
     
     # Add verification text
-    draw.text((seal_x - 35, seal_y + 20), "VERIFIED", font=small_font, fill=COLORS['success'])
+    draw.text((seal_x - px(35), seal_y + px(20)), "VERIFIED", font=small_font, fill=colors['success'])
     
     # Add explanatory text
     verify_text = "This document certifies that a blockchain transaction has been initiated."
-    draw.text((70, verify_y + 30), verify_text, font=small_font, fill=COLORS['dark'])
-    
-    # Add timestamp verification
-    time_verify = f"Timestamp: {date_str} {time_str} UTC"
-    draw.text((70, verify_y + 60), time_verify, font=small_font, fill=COLORS['muted'])
+    draw.text((px(70), verify_y + px(30)), verify_text, font=small_font, fill=colors['dark'])
     
     # Add footer
-    footer_y = height - 40
+    footer_y = layout['footer_y']
     footer_text = "This is an electronic representation of a blockchain transaction. Verify on-chain for final confirmation."
     draw.text((width//2 - draw.textlength(footer_text, font=tiny_font)//2, footer_y), 
-              footer_text, font=tiny_font, fill=COLORS['muted'])
+              footer_text, font=tiny_font, fill=colors['muted'])
     
-    # Convert image to base64
-    buffer = io.BytesIO()
-    image.save(buffer, format='PNG')
-    img_str = base64.b64encode(buffer.getvalue()).decode('utf-8')
+    return image
+
+def get_contract_template(currency_type, size=(900, 600), theme='default', mode='RGBA'):
+    """
+    Returns the cached static template, building it on first use
     
-    return img_str
+    Unknown currencies all share the generic template since they use the same icon.
+    The returned image is shared, so callers must copy() it before drawing.
+    Mode RGB returns the template flattened onto white, for opaque output.
+    Templates at sizes other than the presets may be evicted again, see
+    TEMPLATE_CACHE_BYTES.
+    """
+    global _sized_template_bytes
+    if currency_type not in CURRENCIES:
+        currency_type = None
+    key = (currency_type, tuple(size), theme, mode)
+    pinned = key[1] in PRESET_CANVAS_SIZES
+    if pinned:
+        template = _template_cache.get(key)
+    else:
+        with _template_lock:
+            template = _sized_template_cache.get(key)
+            if template is not None:
+                _sized_template_cache.move_to_end(key)
+    metrics.inc('contract_template_cache_total', {'result': 'hit' if template is not None else 'miss'})
+    if template is None:
+        with _template_lock:
+            cache = _template_cache if pinned else _sized_template_cache
+            template = cache.get(key)
+            if template is None:
+                template = build_contract_template(currency_type, tuple(size), theme)
+                if mode == 'RGB':
+                    # The RGBA layers are only needed to flatten, keeping them would double the memory
+                    template = flatten_image(template)
+                cache[key] = template
+                if not pinned:
+                    _sized_template_bytes += template_bytes(template)
+                    # Drop the least recently used sizes, but always keep the one just built
+                    while _sized_template_bytes > TEMPLATE_CACHE_BYTES and len(_sized_template_cache) > 1:
+                        _, evicted = _sized_template_cache.popitem(last=False)
+                        _sized_template_bytes -= template_bytes(evicted)
+    return template
 
-@app.route('/generate-contract', methods=['POST', 'GET'])
-def generate_contract():
-    # Get payment data from request (either POST JSON or GET parameters)
-    try:
-        if request.method == 'POST':
-            payment_data = request.json
-        else:  # GET request
-            payment_data = {
-                'amount': request.args.get('amount', type=float),
-                'sender': request.args.get('sender'),
-                'receiver': request.args.get('receiver'),
-                'timestamp': request.args.get('timestamp'),
-                'currency': request.args.get('currency'),
-                'currencyName': request.args.get('currencyName'),
-                'currencySymbol': request.args.get('currencySymbol')
-            }
-            
-            # Handle empty values
-            payment_data = {k: v for k, v in payment_data.items() if v is not None}
-    except Exception as e:
-        return jsonify({"error": f"Invalid request data: {str(e)}"}), 400
+def template_bytes(image):
+    """Returns the size of an image's pixel data in bytes"""
+    return image.width * image.height * len(image.getbands())
+
+def flatten_image(image, background=(255, 255, 255)):
+    """Composites an RGBA image onto an opaque background color and returns it as RGB"""
+    flattened = Image.new('RGBA', image.size, background + (255,))
+    flattened.alpha_composite(image)
+    return flattened.convert('RGB')
+
+# Output encoder presets, from full quality PNG to cheap previews
+OUTPUT_PRESETS = {
+    'default': {'format': 'PNG'},
+    'fast': {'format': 'PNG', 'compress_level': 1},
+    'palette': {'format': 'PNG', 'palette': True},
+    'small': {'format': 'PNG', 'palette': True, 'optimize': True},
+    'webp': {'format': 'WEBP', 'lossless': True, 'method': 0},
+    'webp-lossy': {'format': 'WEBP', 'quality': 80, 'method': 2},
+    'preview': {'format': 'JPEG', 'quality': 70},
+    'svg': {'format': 'SVG'},
+}
+
+# Mimetype and file extension for each output format
+OUTPUT_FORMATS = {
+    'PNG': ('image/png', 'png'),
+    'WEBP': ('image/webp', 'webp'),
+    'JPEG': ('image/jpeg', 'jpg'),
+    'SVG': ('image/svg+xml', 'svg'),
+}
+
+# Server-wide preset used when a request does not ask for one
+DEFAULT_OUTPUT_PRESET = os.environ.get('OUTPUT_PRESET', 'default')
+
+# Render memory mode: 'standard' copies the template for every render, 'bounded' draws on a
+# canvas and encodes into a buffer that each thread reuses, within RENDER_MEMORY_BUDGET
+RENDER_MEMORY_MODE = os.environ.get('RENDER_MEMORY_MODE', 'standard').lower()
+if RENDER_MEMORY_MODE not in ('standard', 'bounded'):
+    raise ValueError(f"Unknown render memory mode: {RENDER_MEMORY_MODE}")
+
+# Keep the alpha channel unless a request asks for opaque output, bounded mode renders opaque by default
+RENDER_TRANSPARENT = os.environ.get('RENDER_TRANSPARENT', 'false' if RENDER_MEMORY_MODE == 'bounded' else 'true').lower() == 'true'
+
+def output_options(preset=None, image_format=None, compress_level=None, quality=None, palette=None, transparent=None):
+    """
+    Resolves encoder settings from a preset and optional per-request overrides
     
-    # Validate required fields
-    required_fields = ['amount', 'sender', 'receiver']
-    missing_fields = [field for field in required_fields if field not in payment_data]
-    
-    if missing_fields:
-        return jsonify({"error": f"Missing required fields: {', '.join(missing_fields)}"}), 400
-    
-    # Set defaults for optional fields
-    if 'timestamp' not in payment_data:
-        payment_data['timestamp'] = datetime.now().isoformat()
-    if 'currency' not in payment_data:
-        payment_data['currency'] = 'eth'
-    if 'currencyName' not in payment_data:
-        currency_names = {
-            'btc': 'Bitcoin',
-            'eth': 'Ethereum',
-            'usdt': 'Tether',
-            'sol': 'Solana',
-            'bnb': 'Binance Coin'
-        }
-        payment_data['currencyName'] = currency_names.get(payment_data['currency'].lower(), 'Cryptocurrency')
-    if 'currencySymbol' not in payment_data:
-        currency_symbols = {
-            'btc': 'BTC',
-            'eth': 'ETH',
-            'usdt': 'USDT',
-            'sol': 'SOL',
-            'bnb': 'BNB'
-        }
-        payment_data['currencySymbol'] = currency_symbols.get(payment_data['currency'].lower(), payment_data['currency'].upper())
+    Args:
+        preset (str): Name of a preset in OUTPUT_PRESETS, defaults to DEFAULT_OUTPUT_PRESET
+        image_format (str): png, webp, jpeg or svg; replaces the preset if it uses another format
+        compress_level (int): PNG zlib level 0-9
+        quality (int): WebP/JPEG quality 1-100
+        palette (bool): Quantize PNG output to an 8-bit palette
+        transparent (bool): Keep the alpha channel, defaults to RENDER_TRANSPARENT; JPEG is always opaque
+        
+    Returns:
+        dict: Encoder settings for encode_image
+        
+    Raises:
+        ValueError: If a setting is unknown or out of range
+    """
+    name = preset or DEFAULT_OUTPUT_PRESET
+    if name not in OUTPUT_PRESETS:
+        raise ValueError(f"Unknown output preset: {name}")
+    options = dict(OUTPUT_PRESETS[name])
+    
+    if image_format is not None:
+        image_format = image_format.upper().replace('JPG', 'JPEG')
+        if image_format not in OUTPUT_FORMATS:
+            raise ValueError(f"Unsupported image format: {image_format.lower()}")
+        if image_format != options['format']:
+            options = {'format': image_format}
+    if compress_level is not None:
+        if options['format'] != 'PNG' or not 0 <= compress_level <= 9:
+            raise ValueError("compress_level must be between 0 and 9 and only applies to PNG")
+        options['compress_level'] = compress_level
+    if quality is not None:
+        if options['format'] not in ('WEBP', 'JPEG') or not 1 <= quality <= 100:
+            raise ValueError("quality must be between 1 and 100 and only applies to WebP and JPEG")
+        options['quality'] = quality
+        options.pop('lossless', None)
+    if palette is not None:
+        if palette and options['format'] != 'PNG':
+            raise ValueError("palette only applies to PNG")
+        options['palette'] = palette
+    if options['format'] == 'WEBP' and not features.check('webp'):
+        raise ValueError("WebP output is not supported by this server")
+    # Opaque PNG and WebP output is rendered in RGB, a quarter less memory than RGBA
+    if transparent is None:
+        transparent = RENDER_TRANSPARENT
+    if not transparent and options['format'] in ('PNG', 'WEBP'):
+        options['transparent'] = False
+    return options
+
+def encode_image(image, options=None, buffer=None):
+    """
+    Encodes a rendered contract with the given encoder settings
+    
+    Args:
+        image (Image): RGBA or RGB contract image
+        options (dict): Settings from output_options, PNG at default settings if None
+        buffer (BytesIO): Reusable buffer to encode into, positioned at its start
+        
+    Returns:
+        bytes: Encoded image data
+    """
+    options = options or OUTPUT_PRESETS['default']
+    image_format = options['format']
+    save_args = {}
+    
+    if image_format == 'PNG':
+        if options.get('palette'):
+            # The contract only uses a handful of colors, so 8-bit keeps it visually lossless
+            image = image.quantize(colors=256, method=Image.FASTOCTREE)
+        if 'compress_level' in options:
+            save_args['compress_level'] = options['compress_level']
+        if options.get('optimize'):
+            save_args['optimize'] = True
+    elif image_format == 'WEBP':
+        save_args['lossless'] = options.get('lossless', False)
+        save_args['method'] = options.get('method', 4)
+        if 'quality' in options:
+            save_args['quality'] = options['quality']
+    elif image_format == 'JPEG':
+        # JPEG has no alpha channel, flatten onto white
+        if image.mode == 'RGBA':
+            image = flatten_image(image)
+        save_args['quality'] = options.get('quality', 75)
+    
+    if buffer is None:
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, **save_args)
+        return buffer.getvalue()
+    
+    # A reused buffer keeps its capacity and may still hold a longer, older image past this one
+    image.save(buffer, format=image_format, **save_args)
+    size = buffer.tell()
+    with buffer.getbuffer() as view:
+        return bytes(view[:size])
+
+def format_payment_text(payment_data, tx_id=None):
+    """
+    Formats the payment-specific strings, shared by the raster and the SVG renderer
+    
+    Args:
+        payment_data (dict): Contains amount, sender, receiver, date, time, and cryptocurrency type
+        tx_id (str): Transaction ID to print, a random one is generated if not given
+        
+    Returns:
+        dict: Display strings for the date, transaction ID, amount, currency, addresses and timestamp
+    """
+    # Extract payment data
+    amount = payment_data.get('amount', 0)
+    sender = payment_data.get('sender', 'Unknown')
+    receiver = payment_data.get('receiver', 'Unknown')
+    timestamp = payment_data.get('timestamp', datetime.now().isoformat())
+    currency_name = payment_data.get('currencyName', 'Bitcoin')
+    currency_symbol = payment_data.get('currencySymbol', 'BTC')
+    
+    # Format addresses for display (show only first 6 and last 4 characters)
+    def format_address(address):
+        if len(address) > 10:
+            return f"{address[:6]}...{address[-4:]}"
+        return address
+    
+    # Generate a unique transaction ID
+    if tx_id is None:
+        tx_id = ''.join(random.choice('0123456789abcdef') for _ in range(16))
     
+    # Parse timestamp
     try:
-        # Create the contract image
-        base64_image = create_contract_image(payment_data)
+        dt = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
+        date_str = dt.strftime('%b %d, %Y')
+        time_str = dt.strftime('%I:%M %p')
+    except (ValueError, TypeError):
+        date_str = "Unknown Date"
+        time_str = "Unknown Time"
+    
+    return {
+        'date': f"{date_str} · {time_str}",
+        'tx_id': f"Transaction ID: {tx_id}",
+        'amount': f"{amount} {currency_symbol}",
+        'currency': f"({currency_name})",
+        'sender': format_address(sender),
+        'receiver': format_address(receiver),
+        'time_verify': f"Timestamp: {date_str} {time_str} UTC",
+    }
+
+def draw_payment_details(image, payment_data, tx_id=None):
+    """
+    Draws the payment-specific text onto a copy of the contract template
+    
+    Args:
+        image (Image): Template copy to draw on, the layout scales with its width
+        payment_data (dict): Contains amount, sender, receiver, date, time, and cryptocurrency type
+        tx_id (str): Transaction ID to print, a random one is generated if not given
+    """
+    text = format_payment_text(payment_data, tx_id)
+    layout = contract_layout(image.width, image.height)
+    px = layout['px']
+    
+    # Get better fonts
+    with metrics.time('fonts'):
+        title_font = scaled_font(layout, 32)
+        regular_font = scaled_font(layout, 20)
+        small_font = scaled_font(layout, 16)
+        tiny_font = scaled_font(layout, 12)
+    
+    # Draw date under the title
+    circle_pos = layout['circle_pos']
+    draw_text(image, (circle_pos[0] + layout['circle_size']//2 + px(20), px(70)), text['date'], small_font, (220, 255, 220))
+    
+    # Draw transaction ID
+    draw_text(image, (px(50), layout['line_y'] + px(15)), text['tx_id'], tiny_font, COLORS['muted'])
+    
+    # Draw amount with currency symbol
+    amount_y = layout['amount_y']
+    draw_text(image, (px(70), amount_y + px(50)), text['amount'], title_font, COLORS['primary'])
+    
+    # Draw currency name
+    amount_w = text_width(text['amount'], title_font)
+    draw_text(image, (px(80) + amount_w, amount_y + px(55)), text['currency'], regular_font, COLORS['muted'])
+    
+    # Draw sender and receiver addresses
+    info_y = layout['info_y']
+    draw_text(image, (px(70), info_y + px(40)), text['sender'], regular_font, COLORS['dark'])
+    draw_text(image, (px(70), info_y + px(130)), text['receiver'], regular_font, COLORS['dark'])
+    
+    # Add timestamp verification
+    draw_text(image, (px(70), layout['verify_y'] + px(60)), text['time_verify'], small_font, COLORS['muted'])
+
+def create_contract_image(payment_data, tx_id=None, output=None, scale=1.0):
+    """
+    Creates a visually appealing contract image based on payment data
+    
+    The static layers come from the cached template, so only the payment
+    details are drawn per call.
+    
+    Args:
+        payment_data (dict): Contains amount, sender, receiver, date, time, and cryptocurrency type
+        tx_id (str): Transaction ID to print, a random one is generated if not given
+        output (dict): Encoder settings from output_options, PNG if not given, SVG skips rasterizing
+        scale (float): Render scale, 1.0 is the 900x600 base size
         
-        # Check if the parameter 'download' is present in the request
-        download = request.args.get('download', 'false').lower() == 'true'
+    Returns:
+        bytes: Encoded image data
+    """
+    output = output or OUTPUT_PRESETS['default']
+    if output['format'] == 'SVG':
+        with metrics.time('svg'):
+            image_data = create_contract_svg(payment_data, tx_id, scale)
+        metrics.observe('contract_output_bytes', len(image_data), {'format': 'SVG'}, buckets=SIZE_BUCKETS)
+        return image_data
+    
+    currency_type = payment_data.get('currency', 'btc').lower()
+    size = canvas_size(scale)
+    mode = 'RGBA' if output.get('transparent', True) and output['format'] != 'JPEG' else 'RGB'
+    bounded = RENDER_MEMORY_MODE == 'bounded'
+    
+    # Roughly the canvas plus the encoder's working copy
+    with render_memory.reserve(size[0] * size[1] * Image.getmodebands(mode) * 2):
+        # Start from a copy of the pre-rendered static layers
+        with metrics.time('template'):
+            template = get_contract_template(currency_type, size, mode=mode)
+            image = render_canvas(template) if bounded else template.copy()
+        with metrics.time('draw'):
+            draw_payment_details(image, payment_data, tx_id)
         
-        if download and request.method == 'GET':
-            # Decode the base64 string back to binary
-            image_data = base64.b64decode(base64_image)
-            
-            # Generate a filename based on transaction details
-            filename = f"blockchain_contract_{payment_data['currency']}_{payment_data['amount']}.png"
-            
-            # Create a response with the image data
-            response = app.response_class(
-                response=image_data,
-                status=200,
-                mimetype='image/png'
-            )
-            
-            # Add Content-Disposition header to trigger download
-            response.headers.set('Content-Disposition', f'attachment; filename="{filename}"')
-            
-            return response
-        else:
-            # Return the image as base64 JSON
-            return jsonify({
-                "success": True,
-                "image": f"data:image/png;base64,{base64_image}"
-            })
+        # Encode, callers base64 it only when embedding in JSON
+        with metrics.time('encode'):
+            image_data = encode_image(image, output, buffer=render_buffer() if bounded else None)
+    metrics.observe('contract_output_bytes', len(image_data), {'format': output['format']}, buckets=SIZE_BUCKETS)
+    return image_data
+
+# Bytes of canvas and encoder memory the renders of this process may hold at once (0 = no limit)
+RENDER_MEMORY_BUDGET = int(os.environ.get('RENDER_MEMORY_BUDGET', 64 * 1024 * 1024 if RENDER_MEMORY_MODE == 'bounded' else 0))
+
+class MemoryBudget:
+    """
+    Limits the estimated memory of the renders running at once in this process
     
-    except Exception as e:
+    A render that does not fit waits for earlier ones to finish. A single
+    render always runs, even if it alone is over the budget.
+    """
+    
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_use = 0
+        self.peak = 0
+        self.waits = 0
+        self._condition = threading.Condition()
+    
+    @contextmanager
+    def reserve(self, nbytes):
+        """Holds nbytes of the budget for the enclosed block"""
+        if self.max_bytes <= 0:
+            yield
+            return
+        with self._condition:
+            if self.in_use and self.in_use + nbytes > self.max_bytes:
+                self.waits += 1
+                started = time.perf_counter()
+                while self.in_use and self.in_use + nbytes > self.max_bytes:
+                    self._condition.wait()
+                metrics.observe_stage('memory_wait', time.perf_counter() - started)
+            self.in_use += nbytes
+            self.peak = max(self.peak, self.in_use)
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.in_use -= nbytes
+                self._condition.notify_all()
+    
+    def stats(self):
+        return {
+            "budget_bytes": self.max_bytes,
+            "in_use_bytes": self.in_use,
+            "peak_bytes": self.peak,
+            "waits": self.waits
+        }
+
+render_memory = MemoryBudget(RENDER_MEMORY_BUDGET)
+
+# Canvas and output buffer reused by the renders of each thread in bounded mode
+_render_local = threading.local()
+
+def render_canvas(template):
+    """Returns this thread's reusable canvas, overwritten with the template"""
+    canvas = getattr(_render_local, 'canvas', None)
+    if canvas is None or canvas.mode != template.mode or canvas.size != template.size:
+        canvas = _render_local.canvas = Image.new(template.mode, template.size)
+    canvas.paste(template, (0, 0))
+    return canvas
+
+def render_buffer():
+    """Returns this thread's reusable output buffer, rewound to the start"""
+    buffer = getattr(_render_local, 'buffer', None)
+    if buffer is None:
+        buffer = _render_local.buffer = io.BytesIO()
+    buffer.seek(0)
+    return buffer
+
+def memory_stats():
+    """Returns the peak and current resident set size of this process and the render budget"""
+    peak_rss = None
+    if resource is not None:
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        if sys.platform != 'darwin':
+            peak_rss *= 1024
+    try:
+        with open('/proc/self/statm') as f:
+            rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        rss = None
+    return {
+        "mode": RENDER_MEMORY_MODE,
+        "peak_rss_bytes": peak_rss,
+        "rss_bytes": rss,
+        **render_memory.stats()
+    }
+
+# Font stack for SVG text, the same faces the raster renderer looks for
+SVG_FONT_FAMILY = "Arial, 'DejaVu Sans', sans-serif"
+
+def svg_color(color):
+    """Returns an RGB tuple as an SVG hex color"""
+    return '#{:02x}{:02x}{:02x}'.format(*color[:3])
+
+def font_ascent(size):
+    """Returns the ascent of the contract font, Pillow places text by its top and SVG by its baseline"""
+    font = get_better_font(size)
+    return font.getmetrics()[0] if isinstance(font, ImageFont.FreeTypeFont) else round(size * 0.8)
+
+def svg_text(x, y, text, size, color, anchor='start'):
+    """Returns an SVG text element at the position Pillow would draw the text"""
+    anchor_attribute = f' text-anchor="{anchor}"' if anchor != 'start' else ''
+    return (f'<text x="{x:g}" y="{y + font_ascent(size):g}" font-size="{size}" '
+            f'fill="{svg_color(color)}"{anchor_attribute}>{text}</text>')
+
+@functools.lru_cache(maxsize=32)
+def svg_template(currency_type, theme='default'):
+    """
+    Builds the SVG document of a currency with placeholders for the payment details
+    
+    Mirrors build_contract_template and draw_payment_details at the 900x600
+    base layout; the output size only changes the width and height attributes.
+    
+    Args:
+        currency_type (str): Lowercase currency code, None for the generic template
+        theme (str): Name of the color theme in THEMES
+        
+    Returns:
+        string.Template: Document with $width, $height and one placeholder per text from format_payment_text
+    """
+    colors = THEMES[theme]
+    layout = contract_layout(BASE_WIDTH, BASE_HEIGHT)
+    width, height = BASE_WIDTH, BASE_HEIGHT
+    currency = CURRENCIES.get(currency_type, UNKNOWN_CURRENCY)
+    header_height = layout['header_height']
+    circle_x, circle_y = layout['circle_pos']
+    circle_r = layout['circle_size'] // 2
+    line_y = layout['line_y']
+    amount_y = layout['amount_y']
+    info_y = layout['info_y']
+    verify_y = layout['verify_y']
+    seal_x, seal_y, seal_r = layout['seal_x'], layout['seal_y'], layout['seal_size'] // 2
+    white = (255, 255, 255)
+    
+    # The stripes follow build_header_background: 5px wide, every 20px, leaning 10px over the header
+    stripe_angle = math.degrees(math.atan(10 / header_height))
+    
+    parts = [
+        '<svg xmlns="http://www.w3.org/2000/svg" width="$width" height="$height" '
+        f'viewBox="0 0 {width} {height}" font-family="{SVG_FONT_FAMILY}">',
+        '<defs>',
+        '<linearGradient id="background" x1="0" y1="0" x2="0" y2="1">'
+        '<stop offset="0" stop-color="#ffffff"/><stop offset="1" stop-color="#ffffff" stop-opacity="0.6"/>'
+        '</linearGradient>',
+        f'<pattern id="stripes" width="20" height="{header_height}" patternUnits="userSpaceOnUse" '
+        f'patternTransform="skewX({stripe_angle:.4f})">'
+        f'<rect width="20" height="{header_height}" fill="{svg_color(colors["primary"])}"/>'
+        f'<rect width="3" height="{header_height}" fill="#ffffff"/>'
+        f'<rect x="18" width="2" height="{header_height}" fill="#ffffff"/>'
+        '</pattern>',
+        '</defs>',
+        f'<rect width="{width}" height="{height}" fill="url(#background)"/>',
+        f'<rect width="{width}" height="{header_height}" fill="url(#stripes)"/>',
+        f'<circle cx="{circle_x}" cy="{circle_y}" r="{circle_r}" fill="#ffffff"/>',
+        svg_text(circle_x, circle_y - 18, escape(currency.icon), 36, colors[currency.color], anchor='middle'),
+        svg_text(circle_x + circle_r + 20, 30, "Payment Contract", 32, white),
+        svg_text(width - 30, 30, "BLOCKCHAIN BASED CONTRACT", 16, white, anchor='end'),
+        svg_text(circle_x + circle_r + 20, 70, "$date", 16, (220, 255, 220)),
+        f'<line x1="50" y1="{line_y}" x2="{width - 50}" y2="{line_y}" stroke="{svg_color(colors["muted"])}"/>',
+        svg_text(50, line_y + 15, "$tx_id", 12, colors['muted']),
+        svg_text(width - 50, line_y + 15, "BLOCKCHAIN SECURED", 12, colors['success'], anchor='end'),
+        f'<rect x="50" y="{amount_y}" width="{width - 100}" height="{layout["amount_box_height"]}" fill="#f0fdf4"/>',
+        svg_text(70, amount_y + 15, "Amount", 24, colors['secondary']),
+        # The currency name follows the amount 10px further right, at whatever width the client's font gives it
+        f'<text x="70" y="{amount_y + 50 + font_ascent(32)}" font-size="32" fill="{svg_color(colors["primary"])}">$amount'
+        f'<tspan dx="10" dy="{5 + font_ascent(20) - font_ascent(32)}" font-size="20" '
+        f'fill="{svg_color(colors["muted"])}">$currency</tspan></text>',
+        svg_text(70, info_y, "From", 24, colors['secondary']),
+        svg_text(70, info_y + 40, "$sender", 20, colors['dark']),
+        svg_text(70, info_y + 90, "To", 24, colors['secondary']),
+        svg_text(70, info_y + 130, "$receiver", 20, colors['dark']),
+        f'<line x1="50" y1="{verify_y}" x2="{width - 50}" y2="{verify_y}" stroke="{svg_color(colors["muted"])}"/>',
+        f'<circle cx="{seal_x}" cy="{seal_y}" r="{seal_r}" fill="none" stroke="{svg_color(colors["success"])}" stroke-width="2"/>',
+        f'<circle cx="{seal_x}" cy="{seal_y}" r="{seal_r - 10}" fill="none" stroke="{svg_color(colors["success"])}"/>',
+        svg_text(seal_x - 10, seal_y - 20, "✓", 40, colors['success']),
+        svg_text(seal_x - 35, seal_y + 20, "VERIFIED", 16, colors['success']),
+        svg_text(70, verify_y + 30, "This document certifies that a blockchain transaction has been initiated.", 16, colors['dark']),
+        svg_text(70, verify_y + 60, "$time_verify", 16, colors['muted']),
+        svg_text(width // 2, layout['footer_y'], "This is an electronic representation of a blockchain transaction. "
+                 "Verify on-chain for final confirmation.", 12, colors['muted'], anchor='middle'),
+        '</svg>',
+    ]
+    return string.Template('\n'.join(parts))
+
+def create_contract_svg(payment_data, tx_id=None, scale=1.0, theme='default'):
+    """
+    Renders a contract as SVG by filling the cached document template
+    
+    Args:
+        payment_data (dict): Contains amount, sender, receiver, date, time, and cryptocurrency type
+        tx_id (str): Transaction ID to print, a random one is generated if not given
+        scale (float): Sets the width and height attributes, the drawing itself is resolution independent
+        theme (str): Name of the color theme in THEMES
+        
+    Returns:
+        bytes: UTF-8 encoded SVG document
+    """
+    currency_type = payment_data.get('currency', 'btc').lower()
+    if currency_type not in CURRENCIES:
+        currency_type = None
+    width, height = canvas_size(scale)
+    fields = {name: escape(value) for name, value in format_payment_text(payment_data, tx_id).items()}
+    return svg_template(currency_type, theme).substitute(fields, width=width, height=height).encode('utf-8')
+
+# Render backend: inline (in the request thread), thread or process pool
+RENDER_EXECUTOR = os.environ.get('RENDER_EXECUTOR', 'inline').lower()
+RENDER_WORKERS = int(os.environ.get('RENDER_WORKERS', os.cpu_count() or 1))
+
+# Renders allowed in flight before new requests are rejected with 503
+RENDER_QUEUE_SIZE = int(os.environ.get('RENDER_QUEUE_SIZE', RENDER_WORKERS * 4))
+
+# Seconds to wait for a single render, and the Retry-After sent when the queue is full
+RENDER_TIMEOUT = float(os.environ.get('RENDER_TIMEOUT', 30))
+RENDER_RETRY_AFTER = int(os.environ.get('RENDER_RETRY_AFTER', 1))
+
+class RenderQueueFull(Exception):
+    """Raised when every render slot of the executor is taken"""
+
+# Comma-separated size presets whose templates are built ahead of traffic
+WARM_UP_SIZES = os.environ.get('WARM_UP_SIZES', 'full')
+
+def warm_templates():
+    """Builds the static templates of every currency at WARM_UP_SIZES, in the mode default output renders in"""
+    mode = 'RGBA' if RENDER_TRANSPARENT else 'RGB'
+    for size in WARM_UP_SIZES.split(','):
+        scale = render_scale(size=size.strip())
+        for currency_type in list(CURRENCIES) + [None]:
+            get_contract_template(currency_type, canvas_size(scale), mode=mode)
+
+def warm_render_worker():
+    """Loads fonts and builds the static templates so the first render is not slower"""
+    warm_templates()
+    for size in (12, 16, 20, 32):
+        get_better_font(size)
+
+class RenderExecutor:
+    """
+    Runs create_contract_image inline, on a thread pool or on a process pool
+    
+    Pools are created lazily in the process that uses them, so the executor
+    is safe to import before gunicorn forks its workers.
+    """
+    
+    def __init__(self, kind, workers, queue_size):
+        if kind not in ('inline', 'thread', 'process'):
+            raise ValueError(f"Unknown render executor: {kind}")
+        self.kind = kind
+        self.workers = workers
+        self.queue_size = queue_size
+        self.in_flight = 0
+        self.rejected = 0
+        self._slots = threading.BoundedSemaphore(queue_size)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pool_pid = None
+    
+    def submit(self, payment_data, tx_id=None, output=None, scale=1.0, block=False, coalesce_key=None):
+        """
+        Starts rendering a contract
+        
+        Args:
+            payment_data (dict): Payment data with defaults already applied
+            tx_id (str): Transaction ID passed to create_contract_image
+            output (dict): Encoder settings passed to create_contract_image
+            scale (float): Render scale passed to create_contract_image
+            block (bool): Wait for a free slot instead of raising RenderQueueFull
+            coalesce_key (str): Cache key to share the render with other workers on the host through render_shared
+            
+        Returns:
+            Future: Resolves to the encoded image bytes
+        """
+        # SVG output is a string substitution, cheaper than a round trip to the pool or a lock file
+        vector = output is not None and output['format'] == 'SVG'
+        render = create_contract_image
+        if coalesce_key is not None and not vector and coalesce_directory() is not None:
+            render = functools.partial(render_shared, coalesce_key)
+        
+        if self.kind == 'inline' or vector:
+            future = Future()
+            try:
+                future.set_result(render(payment_data, tx_id=tx_id, output=output, scale=scale))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+        
+        if not self._slots.acquire(blocking=block):
+            with self._lock:
+                self.rejected += 1
+            raise RenderQueueFull(f"Render queue is full ({self.queue_size} in flight)")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._get_pool().submit(render, payment_data, tx_id, output, scale)
+        except Exception:
+            self._release(None)
+            raise
+        future.add_done_callback(self._release)
+        return future
+    
+    def shutdown(self):
+        """Stops the pool, a new one is created on the next submit"""
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None and self._pool_pid == os.getpid():
+            pool.shutdown(wait=False)
+    
+    def stats(self):
+        return {
+            "kind": self.kind,
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "in_flight": self.in_flight,
+            "rejected": self.rejected
+        }
+    
+    def _get_pool(self):
+        with self._lock:
+            # A pool inherited through fork has no live workers in this process
+            if self._pool is None or self._pool_pid != os.getpid():
+                if self.kind == 'thread':
+                    self._pool = ThreadPoolExecutor(self.workers, thread_name_prefix='render')
+                else:
+                    self._pool = ProcessPoolExecutor(self.workers, initializer=warm_render_worker)
+                self._pool_pid = os.getpid()
+            return self._pool
+    
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+render_executor = RenderExecutor(RENDER_EXECUTOR, RENDER_WORKERS, RENDER_QUEUE_SIZE)
+
+# Derive the transaction ID from the payment so identical requests render identical images
+DETERMINISTIC_RENDER = os.environ.get('DETERMINISTIC_RENDER', 'true').lower() == 'true'
+
+# Rendered image cache budget in bytes (0 disables it) and entry lifetime in seconds
+RENDER_CACHE_BYTES = int(os.environ.get('RENDER_CACHE_BYTES', 64 * 1024 * 1024))
+RENDER_CACHE_TTL = int(os.environ.get('RENDER_CACHE_TTL', 3600))
+
+# Payment fields that affect the rendered image, and the ones a request must give
+PAYMENT_FIELDS = ('amount', 'sender', 'receiver', 'timestamp', 'currency', 'currencyName', 'currencySymbol')
+REQUIRED_PAYMENT_FIELDS = ('amount', 'sender', 'receiver')
+
+class PaymentRequest:
+    """
+    A validated and normalized payment, parsed once per request
+    
+    The amount is a finite, non-negative number, the timestamp a valid
+    ISO 8601 string and the currency a lowercase code whose name and symbol
+    come from CURRENCIES unless the request overrides them.
+    """
+    
+    __slots__ = ('amount', 'sender', 'receiver', 'timestamp', 'currency', 'currency_name', 'currency_symbol', '_key')
+    
+    def __init__(self, amount, sender, receiver, timestamp, currency, currency_name, currency_symbol):
+        self.amount = amount
+        self.sender = sender
+        self.receiver = receiver
+        self.timestamp = timestamp
+        self.currency = currency
+        self.currency_name = currency_name
+        self.currency_symbol = currency_symbol
+        self._key = None
+    
+    @classmethod
+    def parse(cls, data):
+        """
+        Validates payment data and fills in defaults for optional fields
+        
+        Args:
+            data (dict): POST JSON object or GET query parameters
+            
+        Returns:
+            PaymentRequest: The normalized payment
+            
+        Raises:
+            ValueError: If the payment is not an object, misses required fields
+                or has an invalid amount, timestamp or text field
+        """
+        if not isinstance(data, dict):
+            raise ValueError("Payment data must be a JSON object")
+        
+        missing_fields = [field for field in REQUIRED_PAYMENT_FIELDS if data.get(field) is None]
+        if missing_fields:
+            raise ValueError(f"Missing required fields: {', '.join(missing_fields)}")
+        
+        currency = parse_text_field(data, 'currency', 'eth').lower()
+        known = CURRENCIES.get(currency)
+        return cls(
+            amount=parse_amount(data['amount']),
+            sender=parse_text_field(data, 'sender'),
+            receiver=parse_text_field(data, 'receiver'),
+            timestamp=parse_timestamp(data.get('timestamp')),
+            currency=currency,
+            currency_name=parse_text_field(data, 'currencyName', known.name if known else UNKNOWN_CURRENCY.name),
+            currency_symbol=parse_text_field(data, 'currencySymbol', known.symbol if known else currency.upper()),
+        )
+    
+    def to_dict(self):
+        """Returns the payment in the dict form create_contract_image takes"""
+        return {
+            'amount': self.amount,
+            'sender': self.sender,
+            'receiver': self.receiver,
+            'timestamp': self.timestamp,
+            'currency': self.currency,
+            'currencyName': self.currency_name,
+            'currencySymbol': self.currency_symbol,
+        }
+    
+    @property
+    def key(self):
+        """Canonical JSON of the rendered fields, equal payments have equal keys"""
+        if self._key is None:
+            self._key = json.dumps(self.to_dict(), sort_keys=True, separators=(',', ':'))
+        return self._key
+
+def parse_amount(value):
+    """Returns the amount as a finite, non-negative int or float, numeric strings become floats"""
+    if isinstance(value, str):
+        try:
+            amount = float(value)
+        except ValueError:
+            raise ValueError(f"Invalid amount: {value!r} is not a number")
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        amount = value
+    else:
+        raise ValueError("Invalid amount: expected a number")
+    if (isinstance(amount, float) and not math.isfinite(amount)) or amount < 0:
+        raise ValueError(f"Invalid amount: {value!r} must be a finite, non-negative number")
+    return amount
+
+def parse_timestamp(value):
+    """Returns the timestamp in canonical ISO 8601 form, or the current time if not given"""
+    if value is None:
+        return datetime.now().isoformat()
+    if not isinstance(value, str):
+        raise ValueError("Invalid timestamp: expected an ISO 8601 string")
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).isoformat()
+    except ValueError:
+        raise ValueError(f"Invalid timestamp: {value!r} is not an ISO 8601 date")
+
+def parse_text_field(data, field, default=None):
+    """Returns a string field of the payment, or the default if it is not given"""
+    value = data.get(field)
+    if value is None:
+        return default
+    if not isinstance(value, str):
+        raise ValueError(f"Invalid {field}: expected a string")
+    return value
+
+def payment_tx_id(payment):
+    """
+    Derives the printed transaction ID from the payment alone
+    
+    Unlike payment_cache_key it ignores the output format and size, so every
+    rendering of the same payment shows the same ID.
+    
+    Args:
+        payment (PaymentRequest): Validated payment, a payment dict is parsed first
+        
+    Returns:
+        str: 16 hex characters
+    """
+    if not isinstance(payment, PaymentRequest):
+        payment = PaymentRequest.parse(payment)
+    return hashlib.sha256(payment.key.encode('utf-8')).hexdigest()[:16]
+
+def currency_slug(currency):
+    """
+    Returns a form of a currency code that is safe in file and archive entry names
+    
+    Registry codes are returned as is. Other codes keep only [a-z0-9], at most
+    16 of them, and fall back to 'other' when nothing is left.
+    """
+    if currency in CURRENCIES:
+        return currency
+    slug = ''.join(c for c in currency.lower() if c in string.ascii_lowercase + string.digits)[:16]
+    return slug or 'other'
+
+def payment_cache_key(payment, output=None, scale=1.0):
+    """
+    Hashes the normalized payment and render settings into a content address
+    
+    Args:
+        payment (PaymentRequest): Validated payment, a payment dict is parsed first
+        output (dict): Encoder settings from output_options
+        scale (float): Render scale
+        
+    Returns:
+        str: Hex SHA-256 digest of the rendered fields
+    """
+    if not isinstance(payment, PaymentRequest):
+        payment = PaymentRequest.parse(payment)
+    settings = json.dumps([output or OUTPUT_PRESETS['default'], scale], sort_keys=True, separators=(',', ':'), default=str)
+    return hashlib.sha256(f"{payment.key}|{settings}".encode('utf-8')).hexdigest()
+
+class RenderCache:
+    """
+    Thread-safe LRU cache of rendered images with a byte budget and TTL
+    """
+    
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        """Returns the cached value for key, or None if missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+    
+    def __contains__(self, key):
+        """Tells whether key has an unexpired entry, without counting a hit or miss"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[0] >= time.monotonic()
+    
+    def put(self, key, value):
+        """Stores value under key, evicting least recently used entries over budget"""
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+    
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.current_bytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions
+        }
+    
+    def _remove(self, key):
+        _, value = self._entries.pop(key)
+        self.current_bytes -= len(value)
+
+render_cache = RenderCache(RENDER_CACHE_BYTES, RENDER_CACHE_TTL)
+
+# Directory of the persistent render store shared by all workers on the host (disabled when empty)
+RENDER_STORE_DIR = os.environ.get('RENDER_STORE_DIR', '')
+RENDER_STORE_BYTES = int(os.environ.get('RENDER_STORE_BYTES', 1024 * 1024 * 1024))
+
+# Seconds between last-access updates of the same store entry, and how many
+# recent updates each process remembers to skip the index write
+RENDER_STORE_TOUCH_INTERVAL = 60
+RENDER_STORE_TOUCHED_KEYS = 4096
+
+class RenderStore:
+    """
+    Content-addressed on-disk store of rendered images
+    
+    Files are written under a temporary name and renamed into place, so
+    concurrent writers from several gunicorn workers never expose partial
+    files. A SQLite index keeps each entry's size and last access for
+    least-recently-used eviction once the store exceeds its byte budget.
+    """
+    
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, 'index.sqlite3')
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._touched = {}
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as db:
+            db.execute("CREATE TABLE IF NOT EXISTS entries "
+                       "(key TEXT PRIMARY KEY, size INTEGER NOT NULL, accessed REAL NOT NULL)")
+            db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+    
+    def path_for(self, key):
+        return os.path.join(self.directory, key[:2], key)
+    
+    def lookup(self, key):
+        """Returns the file path of a stored image, or None"""
+        path = self.path_for(key)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.touch(key)
+        return path
+    
+    def touch(self, key):
+        """Updates the last access of an entry, at most once per touch interval per process"""
+        now = time.time()
+        if now - self._touched.get(key, 0.0) < RENDER_STORE_TOUCH_INTERVAL:
+            return
+        self._remember_touch(key, now)
+        try:
+            with self._connect() as db:
+                db.execute("UPDATE entries SET accessed = ? WHERE key = ? AND accessed < ?",
+                           (now, key, now - RENDER_STORE_TOUCH_INTERVAL))
+        except sqlite3.OperationalError:
+            # The index is busy, the access time is only a hint for eviction
+            pass
+    
+    def read(self, key):
+        """Returns the stored image bytes, or None"""
+        path = self.lookup(key)
+        if path is None:
+            return None
+        try:
+            with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return mapped[:]
+        except (FileNotFoundError, ValueError):
+            # Evicted by another worker in the meantime
+            return None
+    
+    def put(self, key, data):
+        """Writes an image atomically and evicts old entries over the byte budget"""
+        path = self.path_for(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        with self._connect() as db:
+            now = time.time()
+            db.execute("INSERT OR REPLACE INTO entries (key, size, accessed) VALUES (?, ?, ?)",
+                       (key, len(data), now))
+            total = db.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        self._remember_touch(key, now)
+        if total > self.max_bytes:
+            self.evict(total)
+    
+    def evict(self, total):
+        """Removes least recently used entries until the store is back to 90% of its budget"""
+        target = self.max_bytes * 0.9
+        with self._connect() as db:
+            rows = db.execute("SELECT key, size FROM entries ORDER BY accessed").fetchall()
+            for key, size in rows:
+                if total <= target:
+                    break
+                db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                try:
+                    os.unlink(self.path_for(key))
+                except FileNotFoundError:
+                    pass
+                total -= size
+    
+    def stats(self):
+        with self._connect() as db:
+            entries, size = db.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {
+            "directory": self.directory,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+    
+    def _remember_touch(self, key, now):
+        # Forgetting everything at once keeps this bounded, at worst it costs one early write per key
+        if len(self._touched) >= RENDER_STORE_TOUCHED_KEYS:
+            self._touched.clear()
+        self._touched[key] = now
+    
+    def _connect(self):
+        # SQLite connections must not cross threads or forked processes
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.index_path, timeout=5)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+render_store = RenderStore(RENDER_STORE_DIR, RENDER_STORE_BYTES) if RENDER_STORE_DIR else None
+
+# Directory of the lock files that share identical renders between workers on the host
+# (disabled when empty, renders are then only coalesced within a process), and how long
+# a finished render stays there. It must be private to this user, see coalesce_directory().
+RENDER_COALESCE_DIR = os.environ.get('RENDER_COALESCE_DIR', '')
+RENDER_COALESCE_TTL = float(os.environ.get('RENDER_COALESCE_TTL', 5))
+
+# Seconds between sweeps of expired coalescing files, and between polls of a held lock
+RENDER_COALESCE_SWEEP_INTERVAL = 30
+RENDER_COALESCE_POLL = 0.002
+
+class RenderCoalescer:
+    """
+    Single-flight deduplication of concurrent renders with the same cache key
+    
+    The first request for a key starts the render; requests for the same key
+    arriving while it runs get the same Future instead of starting their own.
+    """
+    
+    def __init__(self):
+        self.leaders = 0
+        self.followers = 0
+        self._in_flight = {}
+        self._lock = threading.Lock()
+    
+    def run(self, key, start):
+        """
+        Joins the render in flight for a key, or starts it
+        
+        Args:
+            key (str): Cache key of the render
+            start (callable): Starts the render and returns its Future, called by the leader only
+            
+        Returns:
+            tuple: (Future of the image bytes shared by every caller, True for the caller that started it)
+        """
+        with self._lock:
+            shared = self._in_flight.get(key)
+            if shared is not None:
+                self.followers += 1
+                metrics.inc('contract_coalesced_total', {'scope': 'process'})
+                return shared, False
+            shared = self._in_flight[key] = Future()
+            self.leaders += 1
+        
+        def relay(done):
+            with self._lock:
+                self._in_flight.pop(key, None)
+            if done.exception() is not None:
+                shared.set_exception(done.exception())
+            else:
+                shared.set_result(done.result())
+        
+        # Start outside the lock, an inline render would otherwise block every other key
+        try:
+            future = start()
+        except BaseException as e:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            shared.set_exception(e)
+            raise
+        future.add_done_callback(relay)
+        return shared, True
+    
+    def stats(self):
+        return {
+            "in_flight": len(self._in_flight),
+            "leaders": self.leaders,
+            "followers": self.followers,
+            "directory": coalesce_directory()
+        }
+
+render_coalescer = RenderCoalescer()
+
+_last_coalesce_sweep = 0.0
+_coalesce_dir_private = None
+
+def coalesce_directory():
+    """
+    Returns RENDER_COALESCE_DIR once it is known to be private to this user, or None
+    
+    The directory is created with mode 0700. An existing one must be a real
+    directory owned by this user with no group or other access, otherwise
+    another local user could plant results in it and host coalescing stays off.
+    """
+    global _coalesce_dir_private
+    if not RENDER_COALESCE_DIR or fcntl is None:
+        return None
+    if _coalesce_dir_private is None:
+        try:
+            os.makedirs(RENDER_COALESCE_DIR, mode=0o700, exist_ok=True)
+            info = os.lstat(RENDER_COALESCE_DIR)
+            _coalesce_dir_private = (stat.S_ISDIR(info.st_mode) and info.st_uid == os.getuid()
+                                     and not info.st_mode & 0o077)
+        except OSError:
+            _coalesce_dir_private = False
+    return RENDER_COALESCE_DIR if _coalesce_dir_private else None
+
+def coalesce_failed():
+    """Checks the coalescing directory again on next use, after an I/O error in it"""
+    global _coalesce_dir_private
+    _coalesce_dir_private = None
+
+def render_shared(key, payment_data, tx_id=None, output=None, scale=1.0):
+    """
+    Renders a contract once per host for concurrent identical requests
+    
+    Takes an exclusive flock on a lock file named after the key. The holder
+    renders and leaves the result next to the lock for RENDER_COALESCE_TTL
+    seconds; workers that had to wait for the lock read that result instead
+    of rendering again. A worker that dies releases its lock with its file
+    descriptors, and a waiter gives up after RENDER_TIMEOUT and renders itself.
+    Coalescing never fails a render: without a usable directory, or on any I/O
+    error in it, the contract is rendered as if coalescing were off.
+    
+    Args:
+        key (str): Cache key of the render
+        payment_data (dict): Payment data passed to create_contract_image
+        tx_id (str): Transaction ID passed to create_contract_image
+        output (dict): Encoder settings passed to create_contract_image
+        scale (float): Render scale passed to create_contract_image
+        
+    Returns:
+        bytes: Encoded image data
+    """
+    directory = coalesce_directory()
+    if directory is None:
+        return create_contract_image(payment_data, tx_id=tx_id, output=output, scale=scale)
+    lock_path = os.path.join(directory, f"{key}.lock")
+    result_path = os.path.join(directory, f"{key}.out")
+    
+    try:
+        fd = os.open(lock_path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+    except OSError:
+        coalesce_failed()
+        return create_contract_image(payment_data, tx_id=tx_id, output=output, scale=scale)
+    try:
+        try:
+            deadline = time.monotonic() + RENDER_TIMEOUT
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() >= deadline:
+                        break
+                    time.sleep(RENDER_COALESCE_POLL)
+        except OSError:
+            # No locking on this file system, render without waiting
+            coalesce_failed()
+        
+        # Also catches a render that finished just before this request arrived
+        image_data = read_coalesced(result_path)
+        if image_data is not None:
+            metrics.inc('contract_coalesced_total', {'scope': 'host'})
+            return image_data
+        
+        image_data = create_contract_image(payment_data, tx_id=tx_id, output=output, scale=scale)
+        try:
+            write_coalesced(directory, result_path, image_data)
+            # The lock file's age tells the sweep whether it is still in use
+            os.utime(fd)
+        except OSError:
+            # Waiters time out and render themselves, this request still has its image
+            coalesce_failed()
+    finally:
+        # Closing the descriptor releases the lock
+        os.close(fd)
+    
+    sweep_coalesced(directory)
+    return image_data
+
+def write_coalesced(directory, path, image_data):
+    """Atomically replaces the finished render at path"""
+    fd_out, temp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd_out, 'wb') as f:
+            f.write(image_data)
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+        raise
+
+def read_coalesced(path):
+    """Returns a finished render younger than RENDER_COALESCE_TTL, or None"""
+    try:
+        with open(path, 'rb') as f:
+            if time.time() - os.fstat(f.fileno()).st_mtime > RENDER_COALESCE_TTL:
+                return None
+            return f.read()
+    except OSError:
+        # Not written yet, or unreadable, either way this request renders itself
+        return None
+
+def sweep_coalesced(directory):
+    """Removes expired results and unused lock files, at most once per sweep interval per process"""
+    global _last_coalesce_sweep
+    now = time.time()
+    if now - _last_coalesce_sweep < RENDER_COALESCE_SWEEP_INTERVAL:
+        return
+    _last_coalesce_sweep = now
+    
+    # A lock older than the render timeout has no waiter left, removing it at worst costs one duplicate render
+    lock_age = RENDER_TIMEOUT + RENDER_COALESCE_TTL
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    age = now - entry.stat().st_mtime
+                    if age > lock_age or (age > RENDER_COALESCE_TTL and not entry.name.endswith('.lock')):
+                        os.unlink(entry.path)
+                except FileNotFoundError:
+                    # Removed by another worker's sweep
+                    pass
+    except OSError:
+        # Tried again at the next interval
+        pass
+
+# Startup progress of this process, reported by /health
+startup_state = {
+    'state': 'cold',            # cold (warms lazily on first use), starting, warming or ready
+    'pid': os.getpid(),
+    'started': time.time(),
+    'preloaded': False,         # warmed in the gunicorn master and inherited through fork
+    'warm_up_seconds': None,
+    'ready_seconds': None,      # from module import (or fork) to ready
+}
+
+def warm_up():
+    """
+    Loads Pillow plugins and fonts, builds the static templates and runs throwaway renders
+    
+    Run in the gunicorn master before forking (preload_app) so the workers
+    share the result copy-on-write, or in each worker before it accepts
+    requests. Render executor pools are not started here since they must
+    not be forked.
+    
+    Returns:
+        float: Seconds spent warming up
+    """
+    started = time.perf_counter()
+    startup_state['state'] = 'warming'
+    
+    # Import every image plugin now rather than on the first encode
+    Image.init()
+    warm_templates()
+    for currency_type in list(CURRENCIES) + [None]:
+        svg_template(currency_type)
+    
+    # One render per output kind touches the fonts, text cache and encoders
+    payment = PaymentRequest.parse({
+        'amount': 1.25,
+        'sender': '0x71C7656EC7ab88b098defB751B7401B5f6d8976F',
+        'receiver': '0x8626f6940E2eb28930eFb4CeF49B2d1F2C9C1199',
+        'timestamp': '2024-03-01T12:30:00Z',
+    })
+    for output in (output_options(), output_options(preset=THUMBNAIL_OUTPUT_PRESET), output_options(preset='svg')):
+        create_contract_image(payment.to_dict(), tx_id='0' * 16, output=output)
+    
+    # The throwaway renders are not traffic
+    metrics.reset()
+    
+    elapsed = time.perf_counter() - started
+    startup_state['warm_up_seconds'] = round(elapsed, 3)
+    mark_ready()
+    return elapsed
+
+def reset_after_fork():
+    """
+    Resets per-process state in a freshly forked worker
+    
+    Executor pools and SQLite connections already recreate themselves when
+    they see a new pid. The random generator is reseeded so workers do not
+    hand out the same random transaction IDs.
+    """
+    random.seed()
+    startup_state['preloaded'] = startup_state['state'] == 'ready'
+    startup_state['state'] = 'starting'
+    startup_state['pid'] = os.getpid()
+    startup_state['started'] = time.time()
+    startup_state['ready_seconds'] = None
+
+def mark_ready():
+    """Records that this process is ready to serve requests"""
+    startup_state['state'] = 'ready'
+    startup_state['ready_seconds'] = round(time.time() - startup_state['started'], 3)
+
+def with_cache_headers(response, etag):
+    """Adds a strong ETag and Cache-Control to a contract response"""
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = f"public, max-age={RENDER_CACHE_TTL}"
+    return response
+
+def apply_payment_defaults(payment_data):
+    """
+    Validates required payment fields and fills in defaults for optional ones
+    
+    Args:
+        payment_data (dict): Payment data from a request, updated in place
+        
+    Returns:
+        dict: The same payment data, normalized and with defaults applied
+        
+    Raises:
+        ValueError: If the payment is not an object, misses required fields or has invalid values
+    """
+    payment_data.update(PaymentRequest.parse(payment_data).to_dict())
+    return payment_data
+
+def submit_payment(payment, output=None, scale=1.0, block=False):
+    """
+    Starts rendering a contract image, reusing the cached image for identical payments
+    
+    Args:
+        payment (PaymentRequest): Validated payment
+        output (dict): Encoder settings from output_options
+        scale (float): Render scale
+        block (bool): Wait for a free executor slot instead of raising RenderQueueFull
+        
+    Returns:
+        tuple: (cache key or None when rendering is not deterministic, Future of the image bytes)
+    """
+    cache_key = payment_cache_key(payment, output, scale) if DETERMINISTIC_RENDER else None
+    image_data = render_cache.get(cache_key) if cache_key is not None else None
+    if image_data is None and cache_key is not None and render_store is not None:
+        image_data = render_store.read(cache_key)
+        if image_data is not None and RENDER_CACHE_BYTES > 0:
+            render_cache.put(cache_key, image_data)
+    if image_data is not None:
+        future = Future()
+        future.set_result(image_data)
+        return cache_key, future
+    
+    if cache_key is None:
+        return None, render_executor.submit(payment.to_dict(), output=output, scale=scale, block=block)
+    
+    # Identical requests already rendering share that render
+    future, leader = render_coalescer.run(cache_key, lambda: render_executor.submit(
+        payment.to_dict(), tx_id=payment_tx_id(payment), output=output, scale=scale, block=block, coalesce_key=cache_key))
+    if leader:
+        def store(done):
+            if done.exception() is not None:
+                return
+            if RENDER_CACHE_BYTES > 0:
+                render_cache.put(cache_key, done.result())
+            if render_store is not None:
+                render_store.put(cache_key, done.result())
+        future.add_done_callback(store)
+    return cache_key, future
+
+def render_payment(payment, output=None, scale=1.0):
+    """
+    Renders a contract image, reusing the cached image for identical payments
+    
+    Args:
+        payment (PaymentRequest): Validated payment
+        output (dict): Encoder settings from output_options
+        scale (float): Render scale
+        
+    Returns:
+        tuple: (cache key or None when rendering is not deterministic, image bytes)
+        
+    Raises:
+        RenderQueueFull: If the executor has no free slot
+        TimeoutError: If the render takes longer than RENDER_TIMEOUT
+    """
+    with metrics.time('render'):
+        cache_key, future = submit_payment(payment, output, scale)
+        return cache_key, future.result(timeout=RENDER_TIMEOUT)
+
+def busy_response(message, status):
+    """Builds a 503/504 error response that asks the client to retry"""
+    response = jsonify({"error": message})
+    response.status_code = status
+    response.headers['Retry-After'] = str(RENDER_RETRY_AFTER)
+    return response
+
+def request_output_options():
+    """
+    Reads encoder settings from the query string
+    (preset, image_format, compress_level, quality, palette, transparent)
+    """
+    preset = request.args.get('preset')
+    if preset is None and request.args.get('size') == 'thumbnail' and 'image_format' not in request.args:
+        preset = THUMBNAIL_OUTPUT_PRESET
+    palette = request.args.get('palette')
+    transparent = request.args.get('transparent')
+    return output_options(
+        preset=preset,
+        image_format=request.args.get('image_format'),
+        compress_level=request.args.get('compress_level', type=int),
+        quality=request.args.get('quality', type=int),
+        palette=palette.lower() == 'true' if palette is not None else None,
+        transparent=transparent.lower() == 'true' if transparent is not None else None
+    )
+
+def request_render_scale():
+    """Reads the render scale from the size or scale query parameter"""
+    return render_scale(size=request.args.get('size'), scale=request.args.get('scale', type=float))
+
+@app.route('/generate-contract', methods=['POST', 'GET'])
+def generate_contract():
+    parse_started = time.perf_counter()
+    
+    # Get payment data from request (either POST JSON or GET parameters)
+    try:
+        payment_data = request.json if request.method == 'POST' else request.args
+    except Exception as e:
+        metrics.inc('contract_errors_total', {'type': type(e).__name__})
+        return jsonify({"error": f"Invalid request data: {str(e)}"}), 400
+    
+    try:
+        payment = PaymentRequest.parse(payment_data)
+        output = request_output_options()
+        scale = request_render_scale()
+    except ValueError as e:
+        metrics.inc('contract_errors_total', {'type': type(e).__name__})
+        return jsonify({"error": str(e)}), 400
+    mimetype, extension = OUTPUT_FORMATS[output['format']]
+    metrics.observe_stage('parse', time.perf_counter() - parse_started)
+    
+    # Check if the parameter 'download' is present in the request
+    download = request.args.get('download', 'false').lower() == 'true' and request.method == 'GET'
+    
+    # Raw image bytes when downloading or when the client prefers the image type, base64 JSON otherwise
+    binary = download or request.accept_mimetypes.best_match(['application/json', mimetype]) == mimetype
+    
+    # Identical payments map to the same image, so they can be cached and revalidated
+    cache_key = payment_cache_key(payment, output, scale) if DETERMINISTIC_RENDER else None
+    if cache_key is not None:
+        etag = f"{cache_key}-{'bin' if binary else 'json'}"
+        # Weak comparison, as RFC 9110 requires for If-None-Match (proxies that compress send W/"...")
+        if request.if_none_match.contains_weak(etag):
+            response = app.response_class(status=304)
+            # Same Vary as the 200, the ETag differs between the binary and JSON variants
+            response.vary.add('Accept')
+            return with_cache_headers(response, etag)
+    
+    try:
+        # Serve a previously stored image straight from disk, unless its bytes are already in memory
+        if binary and cache_key is not None and render_store is not None and cache_key not in render_cache:
+            store_path = render_store.lookup(cache_key)
+            if store_path is not None:
+                try:
+                    response = send_file(store_path, mimetype=mimetype, conditional=False, etag=False)
+                except FileNotFoundError:
+                    # Evicted since the lookup, render it again below
+                    response = None
+                if response is not None:
+                    if download:
+                        filename = f"blockchain_contract_{payment.currency}_{payment.amount}.{extension}"
+                        response.headers.set('Content-Disposition', f'attachment; filename="{filename}"')
+                    response.vary.add('Accept')
+                    return with_cache_headers(response, etag)
+        
+        # Create the contract image, unless an identical one is cached
+        _, image_data = render_payment(payment, output, scale)
+        
+        if binary:
+            # Send the image buffer as is
+            response = app.response_class(
+                response=image_data,
+                status=200,
+                mimetype=mimetype
+            )
+            
+            if download:
+                # Generate a filename based on transaction details
+                filename = f"blockchain_contract_{payment.currency}_{payment.amount}.{extension}"
+                
+                # Add Content-Disposition header to trigger download
+                response.headers.set('Content-Disposition', f'attachment; filename="{filename}"')
+        else:
+            # Return the image as base64 JSON, assembled as bytes since base64 needs no escaping
+            with metrics.time('base64'):
+                base64_image = base64.b64encode(image_data)
+            with metrics.time('serialize'):
+                body = b''.join((b'{"image":"data:', mimetype.encode('ascii'), b';base64,', base64_image, b'","success":true}\n'))
+                response = app.response_class(body, status=200, mimetype='application/json')
+        
+        response.vary.add('Accept')
+        if cache_key is not None:
+            with_cache_headers(response, etag)
+        return response
+    
+    except RenderQueueFull as e:
+        metrics.inc('contract_errors_total', {'type': 'RenderQueueFull'})
+        return busy_response(str(e), 503)
+    except FutureTimeoutError:
+        metrics.inc('contract_errors_total', {'type': 'RenderTimeout'})
+        return busy_response(f"Render timed out after {RENDER_TIMEOUT:g}s", 504)
+    except Exception as e:
+        metrics.inc('contract_errors_total', {'type': type(e).__name__})
         return jsonify({"error": f"Error generating contract: {str(e)}"}), 500
 
+# Maximum number of payments accepted by /generate-contracts
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 500))
+
+# Maximum size of a batch ZIP archive, and how much of it is kept in memory before spilling to a temporary file
+MAX_BATCH_BYTES = int(os.environ.get('MAX_BATCH_BYTES', 256 * 1024 * 1024))
+BATCH_SPOOL_BYTES = int(os.environ.get('BATCH_SPOOL_BYTES', 16 * 1024 * 1024))
+
+def render_batch(payments, output=None, scale=1.0, ordered=True):
+    """
+    Renders the payments of a batch on the shared executor
+    
+    Args:
+        payments (list): Payment objects with the same rules as /generate-contract
+        output (dict): Encoder settings from output_options, shared by the whole batch
+        scale (float): Render scale, shared by the whole batch
+        ordered (bool): Yield results in input order, otherwise as each render finishes
+        
+    Yields:
+        tuple: (index, PaymentRequest or None if invalid, image bytes or None, error message or None)
+    """
+    def submit(index, payment_data):
+        try:
+            payment = PaymentRequest.parse(payment_data)
+        except ValueError as e:
+            return index, None, None, str(e)
+        try:
+            _, future = submit_payment(payment, output, scale, block=True)
+        except Exception as e:
+            metrics.inc('contract_errors_total', {'type': type(e).__name__})
+            return index, payment, None, str(e)
+        return index, payment, future, None
+    
+    def resolve(index, payment, future, error, timeout=RENDER_TIMEOUT):
+        if future is not None:
+            try:
+                return index, payment, future.result(timeout=timeout), None
+            except FutureTimeoutError:
+                metrics.inc('contract_errors_total', {'type': 'RenderTimeout'})
+                error = f"Render timed out after {RENDER_TIMEOUT:g}s"
+            except Exception as e:
+                metrics.inc('contract_errors_total', {'type': type(e).__name__})
+                error = str(e)
+        elif payment is None:
+            metrics.inc('contract_errors_total', {'type': 'InvalidPayment'})
+        return index, payment, None, error
+    
+    # Keep at most one queue's worth of renders in flight
+    if ordered:
+        pending = deque()
+        for index, payment_data in enumerate(payments):
+            pending.append(submit(index, payment_data))
+            if len(pending) >= render_executor.queue_size:
+                yield resolve(*pending.popleft())
+        while pending:
+            yield resolve(*pending.popleft())
+        return
+    
+    # Renders in flight, oldest first, each with the items waiting on it
+    # (identical payments in a batch share one render)
+    in_flight = OrderedDict()
+    
+    def finish_next():
+        done, _ = wait(list(in_flight), timeout=RENDER_TIMEOUT, return_when=FIRST_COMPLETED)
+        if not done:
+            # Nothing finished for a whole render timeout, give up on the oldest
+            done = {next(iter(in_flight))}
+        for future in [future for future in in_flight if future in done]:
+            for item in in_flight.pop(future):
+                yield resolve(*item, timeout=0)
+    
+    for index, payment_data in enumerate(payments):
+        item = submit(index, payment_data)
+        if item[2] is None:
+            yield resolve(*item)
+            continue
+        in_flight.setdefault(item[2], []).append(item)
+        if len(in_flight) >= render_executor.queue_size:
+            yield from finish_next()
+    while in_flight:
+        yield from finish_next()
+
+@app.route('/generate-contracts', methods=['POST'])
+def generate_contracts():
+    """
+    Renders a JSON array of payments in one request
+    
+    Returns a ZIP archive by default, or NDJSON streamed line by line when
+    format=ndjson is given or Accept prefers application/x-ndjson. Failed
+    items are reported individually and do not fail the batch. A ZIP archive
+    stops at MAX_BATCH_BYTES, the items past it are reported as errors.
+    """
+    payments = request.get_json(silent=True)
+    if not isinstance(payments, list):
+        return jsonify({"error": "Request body must be a JSON array of payments"}), 400
+    if len(payments) > MAX_BATCH_SIZE:
+        return jsonify({"error": f"Batch too large: {len(payments)} payments (max {MAX_BATCH_SIZE})"}), 400
+    try:
+        output = request_output_options()
+        scale = request_render_scale()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    mimetype, extension = OUTPUT_FORMATS[output['format']]
+    
+    output_format = request.args.get('format')
+    if output_format is None:
+        best = request.accept_mimetypes.best_match(['application/zip', 'application/x-ndjson'])
+        output_format = 'ndjson' if best == 'application/x-ndjson' else 'zip'
+    
+    if output_format == 'ndjson':
+        def generate():
+            # Lines go out as renders finish, the index tells the client which item each one is
+            for index, _, image_data, error in render_batch(payments, output, scale, ordered=False):
+                if error is not None:
+                    item = {"index": index, "success": False, "error": error}
+                else:
+                    base64_image = base64.b64encode(image_data).decode('ascii')
+                    item = {"index": index, "success": True, "image": f"data:{mimetype};base64,{base64_image}"}
+                yield json.dumps(item) + '\n'
+        
+        return app.response_class(generate(), status=200, mimetype='application/x-ndjson')
+    
+    if output_format != 'zip':
+        return jsonify({"error": f"Unsupported batch format: {output_format}"}), 400
+    
+    # Image data is already compressed, so entries are stored as is. Large archives
+    # spill to a temporary file instead of being held in memory.
+    spool = tempfile.SpooledTemporaryFile(max_size=BATCH_SPOOL_BYTES)
+    errors = []
+    results = render_batch(payments, output, scale)
+    with zipfile.ZipFile(spool, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for index, payment, image_data, error in results:
+            if error is None and spool.tell() + len(image_data) > MAX_BATCH_BYTES:
+                # Report this and every later item instead of rendering them
+                results.close()
+                message = f"Batch output exceeds {MAX_BATCH_BYTES} bytes"
+                errors.extend({"index": i, "error": message} for i in range(index, len(payments)))
+                break
+            if error is not None:
+                errors.append({"index": index, "error": error})
+                continue
+            # The currency is user input, never let it shape the entry path
+            archive.writestr(f"contract_{index:04d}_{currency_slug(payment.currency)}.{extension}", image_data)
+        archive.writestr("errors.json", json.dumps(errors, indent=2))
+    
+    # Sent from the spool in chunks, the response closes it when done
+    size = spool.tell()
+    spool.seek(0)
+    response = send_file(spool, mimetype='application/zip', as_attachment=True,
+                         download_name='blockchain_contracts.zip', conditional=False, etag=False)
+    response.content_length = size
+    response.headers['X-Batch-Errors'] = str(len(errors))
+    return response
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    endpoint = request.endpoint or 'unknown'
+    started = getattr(g, 'request_started', None)
+    if started is not None:
+        metrics.observe('contract_request_seconds', time.perf_counter() - started, {'endpoint': endpoint})
+    metrics.inc('contract_requests_total', {'endpoint': endpoint, 'status': response.status_code})
+    return response
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Exposes request, stage, cache and executor metrics in the Prometheus text format"""
+    cache = render_cache.stats()
+    fonts = font_cache_stats()
+    executor = render_executor.stats()
+    text_runs = text_cache.stats()
+    widths = text_width.cache_info()
+    memory = memory_stats()
+    extra = [
+        ('contract_render_cache_hits_total', 'counter', 'Rendered image cache hits', {}, cache['hits']),
+        ('contract_render_cache_misses_total', 'counter', 'Rendered image cache misses', {}, cache['misses']),
+        ('contract_render_cache_evictions_total', 'counter', 'Rendered image cache evictions', {}, cache['evictions']),
+        ('contract_render_cache_bytes', 'gauge', 'Bytes held by the rendered image cache', {}, cache['bytes']),
+        ('contract_render_cache_entries', 'gauge', 'Entries in the rendered image cache', {}, cache['entries']),
+        ('contract_font_cache_hits_total', 'counter', 'Font cache hits', {}, fonts['hits']),
+        ('contract_font_cache_misses_total', 'counter', 'Font cache misses', {}, fonts['misses']),
+        ('contract_text_cache_hits_total', 'counter', 'Rasterized text run cache hits', {}, text_runs['hits']),
+        ('contract_text_cache_misses_total', 'counter', 'Rasterized text run cache misses', {}, text_runs['misses']),
+        ('contract_text_width_cache_hits_total', 'counter', 'Text width cache hits', {}, widths.hits),
+        ('contract_text_width_cache_misses_total', 'counter', 'Text width cache misses', {}, widths.misses),
+        ('contract_templates', 'gauge', 'Static templates built in this process', {}, len(_template_cache) + len(_sized_template_cache)),
+        ('contract_template_cache_bytes', 'gauge', 'Pixel data held by evictable templates', {}, _sized_template_bytes),
+        ('contract_executor_in_flight', 'gauge', 'Renders queued or running', {'kind': executor['kind']}, executor['in_flight']),
+        ('contract_executor_rejected_total', 'counter', 'Renders rejected because the queue was full', {'kind': executor['kind']}, executor['rejected']),
+        ('contract_render_memory_in_use_bytes', 'gauge', 'Estimated memory held by running renders', {}, memory['in_use_bytes']),
+        ('contract_render_memory_waits_total', 'counter', 'Renders that waited for the memory budget', {}, memory['waits']),
+    ]
+    if memory['peak_rss_bytes'] is not None:
+        extra.append(('contract_process_peak_rss_bytes', 'gauge', 'Peak resident set size of this process', {}, memory['peak_rss_bytes']))
+    if memory['rss_bytes'] is not None:
+        extra.append(('contract_process_rss_bytes', 'gauge', 'Resident set size of this process', {}, memory['rss_bytes']))
+    return app.response_class(metrics.render(extra), status=200, mimetype='text/plain; version=0.0.4')
+
 @app.route('/health', methods=['GET'])
 def health_check():
+    # Not ready while warming up, a process that was never warmed up serves lazily
+    ready = startup_state['state'] in ('cold', 'ready')
     return jsonify({
-        "status": "healthy", 
+        "status": "healthy" if ready else "starting", 
         "message": "Blockchain Contract API is running",
         "version": "1.1.0",
-        "timestamp": datetime.now().isoformat()
-    }), 200
+        "timestamp": datetime.now().isoformat(),
+        "fonts": font_cache_stats(),
+        "render_cache": render_cache.stats(),
+        "executor": render_executor.stats(),
+        "render_store": render_store.stats() if render_store is not None else None,
+        "coalescing": render_coalescer.stats(),
+        "memory": memory_stats(),
+        "startup": startup_state
+    }), 200 if ready else 503
 
 @app.route('/', methods=['GET'])
 def index():
@@ -523,5 +2553,6 @@ def index():
 if __name__ == '__main__':
     # Get port from environment variable or use 5000 as default
     port = int(os.environ.get('PORT', 5000))
+    warm_up()
     # Run app with host='0.0.0.0' to make it publicly accessible
     app.run(host='0.0.0.0', port=port, debug=True)
@@ -0,0 +1,244 @@
+"""
+ASGI entry point for the contract API
+
+Serves the same Flask routes from an event loop so many slow or idle
+connections do not each hold a worker. Requests for the render endpoints
+run on a bounded thread pool, which in turn hands create_contract_image
+to the configured render executor. Cheap routes like /health use their
+own small pool, so they keep answering while every render slot is busy.
+
+Run with any ASGI server, e.g.:
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+    gunicorn asgi:app -k uvicorn.workers.UvicornWorker
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from app import app as flask_app, render_executor, warm_up, RENDER_RETRY_AFTER
+
+# Concurrent requests running Flask render handlers, and how many more may wait for a slot
+ASGI_RENDER_THREADS = int(os.environ.get('ASGI_RENDER_THREADS', render_executor.queue_size))
+ASGI_MAX_PENDING = int(os.environ.get('ASGI_MAX_PENDING', ASGI_RENDER_THREADS * 4))
+
+# Threads reading the rest of streamed response bodies, outside the render slots
+ASGI_STREAM_THREADS = int(os.environ.get('ASGI_STREAM_THREADS', ASGI_RENDER_THREADS))
+
+# Routes served from the separate light pool instead of the render pool
+ASGI_LIGHT_PATHS = frozenset(os.environ.get('ASGI_LIGHT_PATHS', '/,/health,/metrics').split(','))
+
+# Largest request body accepted, in bytes
+ASGI_MAX_BODY = int(os.environ.get('ASGI_MAX_BODY', 16 * 1024 * 1024))
+
+# Seconds to wait for a render slot before answering 503
+ASGI_QUEUE_TIMEOUT = float(os.environ.get('ASGI_QUEUE_TIMEOUT', 10))
+
+# Run app.warm_up during lifespan startup
+ASGI_WARM_UP = os.environ.get('ASGI_WARM_UP', 'true').lower() == 'true'
+
+class WSGIBridge:
+    """
+    Minimal ASGI adapter that runs a WSGI app on thread pools
+
+    Each request is read fully from the client, handed to the WSGI app on a
+    pool thread, and its response is sent back chunk by chunk, so a slow
+    client only holds a coroutine and never a pool thread or render slot.
+    """
+
+    def __init__(self, wsgi_app, render_threads, max_pending, light_paths, stream_threads=None):
+        self.wsgi_app = wsgi_app
+        self.light_paths = light_paths
+        self.max_pending = max_pending
+        self.render_threads = render_threads
+        self.pending = 0
+        self._render_pool = ThreadPoolExecutor(render_threads, thread_name_prefix='asgi-render')
+        self._light_pool = ThreadPoolExecutor(2, thread_name_prefix='asgi-light')
+        self._stream_pool = ThreadPoolExecutor(stream_threads or render_threads, thread_name_prefix='asgi-stream')
+        self._slots = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            raise RuntimeError(f"Unsupported ASGI scope type: {scope['type']}")
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                # Warm up on a pool thread before the server accepts connections
+                if ASGI_WARM_UP:
+                    await asyncio.get_running_loop().run_in_executor(self._light_pool, warm_up)
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                self._render_pool.shutdown(wait=False)
+                self._light_pool.shutdown(wait=False)
+                self._stream_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            await self._send_error(send, 413, 'Request body too large')
+            return
+
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, body)
+
+        if scope['path'] in self.light_paths:
+            status, headers, chunks = await loop.run_in_executor(self._light_pool, self._start, environ)
+            await self._send_response(send, loop, self._light_pool, status, headers, chunks)
+            return
+
+        # Semaphores bind to the running loop, so it is created on first use
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.render_threads)
+        if self.pending >= self.max_pending:
+            await self._send_error(send, 503, 'Server busy, retry later', retry_after=True)
+            return
+
+        self.pending += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), ASGI_QUEUE_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self._send_error(send, 503, 'Server busy, retry later', retry_after=True)
+            return
+        finally:
+            self.pending -= 1
+
+        try:
+            status, headers, chunks = await loop.run_in_executor(self._render_pool, self._start, environ)
+        finally:
+            self._slots.release()
+        # The slot only covers the handler, a client that reads slowly must not keep it
+        await self._send_response(send, loop, self._stream_pool, status, headers, chunks)
+
+    async def _read_body(self, receive):
+        """Reads the request body, returns None when it exceeds ASGI_MAX_BODY"""
+        chunks = []
+        size = 0
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                break
+            chunk = message.get('body', b'')
+            size += len(chunk)
+            if size > ASGI_MAX_BODY:
+                return None
+            chunks.append(chunk)
+            if not message.get('more_body', False):
+                break
+        return b''.join(chunks)
+
+    def _start(self, environ):
+        """
+        Calls the WSGI app and reads its first body chunk on a pool thread
+
+        Returns:
+            tuple: (status code, header list, iterator over the remaining chunks)
+        """
+        response = {}
+
+        def start_response(status, headers, exc_info=None):
+            response['status'] = int(status.split(' ', 1)[0])
+            response['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                   for name, value in headers]
+
+        iterable = self.wsgi_app(environ, start_response)
+        chunks = ResponseChunks(iterable)
+        # Most Flask responses are a single buffer, read it while on the pool thread
+        chunks.prefetch()
+        return response['status'], response['headers'], chunks
+
+    async def _send_response(self, send, loop, pool, status, headers, chunks):
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        try:
+            while True:
+                chunk = chunks.take()
+                if chunk is None:
+                    chunk = await loop.run_in_executor(pool, chunks.next)
+                if chunk is ResponseChunks.DONE:
+                    break
+                if chunk:
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        finally:
+            chunks.close()
+
+    async def _send_error(self, send, status, message, retry_after=False):
+        """Sends an error in the same JSON shape as the Flask routes"""
+        body = json.dumps({"error": message}, separators=(',', ':')).encode() + b'\n'
+        headers = [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+        if retry_after:
+            headers.append((b'retry-after', str(RENDER_RETRY_AFTER).encode()))
+        await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+        await send({'type': 'http.response.body', 'body': body})
+
+class ResponseChunks:
+    """Iterates a WSGI response body, with the first chunk optionally read ahead"""
+
+    DONE = object()
+
+    def __init__(self, iterable):
+        self._iterable = iterable
+        self._iterator = iter(iterable)
+        self._ready = None
+
+    def prefetch(self):
+        self._ready = self.next()
+
+    def take(self):
+        chunk, self._ready = self._ready, None
+        return chunk
+
+    def next(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            return self.DONE
+
+    def close(self):
+        if hasattr(self._iterable, 'close'):
+            self._iterable.close()
+
+def build_environ(scope, body):
+    """Builds a PEP 3333 environ from an ASGI HTTP scope"""
+    server = scope.get('server') or ('localhost', 80)
+    client = scope.get('client') or ('', 0)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'REMOTE_ADDR': client[0],
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'CONTENT_LENGTH': str(len(body)),
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': False,
+        'wsgi.run_once': False,
+    }
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin-1').upper().replace('-', '_')
+        value = value.decode('latin-1')
+        if name == 'CONTENT_TYPE':
+            environ['CONTENT_TYPE'] = value
+        elif name == 'CONTENT_LENGTH':
+            continue
+        else:
+            key = f"HTTP_{name}"
+            environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+app = WSGIBridge(flask_app, ASGI_RENDER_THREADS, ASGI_MAX_PENDING, ASGI_LIGHT_PATHS, ASGI_STREAM_THREADS)
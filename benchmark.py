@@ -0,0 +1,253 @@
+"""
+Render benchmark and latency regression harness
+
+Drives create_contract_image and the Flask test client across representative
+payloads without any network access, and reports latency percentiles,
+throughput, Python allocations and output sizes.
+
+Usage:
+    python benchmark.py                          # print results
+    python benchmark.py --save baseline.json     # write a baseline
+    python benchmark.py --compare baseline.json  # diff against a baseline, exit 1 on regression
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import PIL
+
+import app
+
+LONG_SENDER = '0x71C7656EC7ab88b098defB751B7401B5f6d8976F' * 3
+LONG_RECEIVER = '0x8626f6940E2eb28930eFb4CeF49B2d1F2C9C1199' * 3
+
+def sample_payment(currency='eth', **overrides):
+    """Returns a payment with every field set, as generate_contract would pass it on"""
+    payment = {
+        'amount': 1.25,
+        'sender': '0x71C7656EC7ab88b098defB751B7401B5f6d8976F',
+        'receiver': '0x8626f6940E2eb28930eFb4CeF49B2d1F2C9C1199',
+        'timestamp': '2024-03-01T12:30:00Z',
+        'currency': currency,
+    }
+    payment.update(overrides)
+    return app.apply_payment_defaults(payment)
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def measure(fn, iterations, warmup):
+    """
+    Times fn over a number of iterations
+
+    Args:
+        fn (callable): Returns the produced output, whose length is reported as bytes
+        iterations (int): Timed calls
+        warmup (int): Untimed calls made first
+
+    Returns:
+        dict: Latency percentiles in ms, calls per second, output and allocation sizes
+    """
+    for _ in range(warmup):
+        fn()
+
+    timings = []
+    output_bytes = 0
+    started = time.perf_counter()
+    for _ in range(iterations):
+        t0 = time.perf_counter()
+        output = fn()
+        timings.append(time.perf_counter() - t0)
+        output_bytes = len(output) if output is not None else 0
+    elapsed = time.perf_counter() - started
+
+    # Allocations are measured in a separate call since tracing slows everything down
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    timings.sort()
+    return {
+        "iterations": iterations,
+        "p50_ms": round(percentile(timings, 50) * 1000, 3),
+        "p95_ms": round(percentile(timings, 95) * 1000, 3),
+        "p99_ms": round(percentile(timings, 99) * 1000, 3),
+        "mean_ms": round(sum(timings) / len(timings) * 1000, 3),
+        "per_second": round(iterations / elapsed, 1) if elapsed else 0.0,
+        "python_alloc_peak_kb": round(peak / 1024, 1),
+        "output_bytes": output_bytes,
+    }
+
+def renderer_scenarios():
+    """Yields (name, callable) pairs that call the renderer directly"""
+    for currency in list(app.CRYPTO_ICONS) + ['doge']:
+        payment = sample_payment(currency)
+        yield f"render/{currency}", lambda payment=payment: app.create_contract_image(payment, tx_id='0' * 16)
+
+    payment = sample_payment(sender=LONG_SENDER, receiver=LONG_RECEIVER, amount=123456789.123456789)
+    yield "render/long-fields", lambda: app.create_contract_image(payment, tx_id='0' * 16)
+
+    for size, scale in app.SIZE_PRESETS.items():
+        payment = sample_payment()
+        yield f"render/size-{size}", lambda payment=payment, scale=scale: app.create_contract_image(payment, tx_id='0' * 16, scale=scale)
+
+    for preset in app.OUTPUT_PRESETS:
+        try:
+            options = app.output_options(preset=preset)
+        except ValueError:
+            continue
+        payment = sample_payment()
+        yield f"render/preset-{preset}", lambda payment=payment, options=options: app.create_contract_image(payment, tx_id='0' * 16, output=options)
+
+def stage_scenarios():
+    """Yields (name, callable) pairs for the individual render stages"""
+    payment = sample_payment()
+    size = app.canvas_size(1.0)
+    template = app.get_contract_template('eth', size)
+    drawn = template.copy()
+    app.draw_payment_details(drawn, payment, tx_id='0' * 16)
+
+    def background():
+        app.build_contract_template('eth', size)
+
+    def paste():
+        template.copy()
+
+    def text():
+        app.draw_payment_details(template.copy(), payment, tx_id='0' * 16)
+
+    yield "stage/background", background
+    yield "stage/paste", paste
+    yield "stage/text", text
+    yield "stage/encode", lambda: app.encode_image(drawn)
+
+def http_scenarios():
+    """Yields (name, callable) pairs that go through the Flask test client"""
+    client = app.app.test_client()
+    query = ('/generate-contract?amount=1.25&sender=0x71C7656EC7ab88b098defB751B7401B5f6d8976F'
+             '&receiver=0x8626f6940E2eb28930eFb4CeF49B2d1F2C9C1199&currency=eth&timestamp=2024-03-01T12:30:00Z')
+    body = {
+        'amount': 1.25,
+        'sender': LONG_SENDER,
+        'receiver': LONG_RECEIVER,
+        'currency': 'btc',
+        'timestamp': '2024-03-01T12:30:00Z',
+    }
+
+    # Finished renders kept for coalescing would otherwise answer the uncached scenarios
+    app.RENDER_COALESCE_DIR = ''
+
+    def uncached(fn):
+        # Every request must render, so the cache is cleared first
+        def call():
+            app.render_cache.clear()
+            return fn()
+        return call
+
+    def check(response):
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return response.get_data()
+
+    yield "http/get-json", uncached(lambda: check(client.get(query)))
+    yield "http/get-download", uncached(lambda: check(client.get(query + '&download=true')))
+    yield "http/get-png", uncached(lambda: check(client.get(query, headers={'Accept': 'image/png'})))
+    yield "http/post-json", uncached(lambda: check(client.post('/generate-contract', json=body)))
+    yield "http/get-json-cached", lambda: check(client.get(query))
+    yield "http/health", lambda: check(client.get('/health'))
+
+def run(iterations, warmup, include_http=True, name_filter=None):
+    """Runs every scenario and returns the results keyed by scenario name"""
+    groups = [renderer_scenarios(), stage_scenarios()]
+    if include_http:
+        groups.append(http_scenarios())
+
+    results = {}
+    for group in groups:
+        for name, fn in group:
+            if name_filter and name_filter not in name:
+                continue
+            results[name] = measure(fn, iterations, warmup)
+            print(format_row(name, results[name]), file=sys.stderr)
+    return results
+
+def format_row(name, result):
+    return (f"{name:<28} p50 {result['p50_ms']:>8.2f}ms  p95 {result['p95_ms']:>8.2f}ms  "
+            f"p99 {result['p99_ms']:>8.2f}ms  {result['per_second']:>8.1f}/s  "
+            f"{result['output_bytes']:>8} B  alloc {result['python_alloc_peak_kb']:>8.1f} KB")
+
+def compare(baseline, results, threshold):
+    """
+    Prints the change of every scenario against a baseline
+
+    Returns:
+        list: Names of scenarios whose p95 grew by more than threshold
+    """
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<28} new", file=sys.stderr)
+            continue
+        changes = []
+        for metric in ('p50_ms', 'p95_ms', 'output_bytes'):
+            if before[metric]:
+                changes.append((metric, (result[metric] - before[metric]) / before[metric]))
+        summary = '  '.join(f"{metric} {change:+.1%}" for metric, change in changes)
+        regressed = dict(changes).get('p95_ms', 0) > threshold
+        if regressed:
+            regressions.append(name)
+        print(f"{name:<28} {summary}{'  REGRESSION' if regressed else ''}", file=sys.stderr)
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark contract rendering")
+    parser.add_argument('--iterations', type=int, default=50, help="timed calls per scenario")
+    parser.add_argument('--warmup', type=int, default=5, help="untimed calls per scenario")
+    parser.add_argument('--filter', help="only run scenarios whose name contains this text")
+    parser.add_argument('--no-http', action='store_true', help="skip the Flask test client scenarios")
+    parser.add_argument('--save', metavar='PATH', help="write the results as a JSON baseline")
+    parser.add_argument('--compare', metavar='PATH', help="diff the results against a JSON baseline")
+    parser.add_argument('--threshold', type=float, default=0.15,
+                        help="p95 growth that counts as a regression (default 0.15 = 15%%)")
+    args = parser.parse_args(argv)
+
+    results = run(args.iterations, args.warmup, include_http=not args.no_http, name_filter=args.filter)
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "font": app.RESOLVED_FONT_PATH,
+            "executor": app.RENDER_EXECUTOR,
+            "iterations": args.iterations,
+        },
+        "results": results,
+    }
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Baseline written to {args.save}", file=sys.stderr)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(baseline.get('results', {}), results, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
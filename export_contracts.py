@@ -0,0 +1,224 @@
+"""
+Bulk export of contract images from a CSV or JSONL file of payments
+
+Reads the input as a stream, applies the same defaults and validation as
+/generate-contract, renders on a process pool and writes each image to a
+directory or into a ZIP archive as soon as it is ready. Memory stays
+bounded by the number of renders in flight.
+
+Rows whose output already exists are skipped, so an interrupted export
+can be resumed by running the same command again with --resume. Ctrl-C
+finishes the renders in flight and closes the output, so both directories
+and ZIP archives resume. After a hard kill (SIGKILL, power loss) only a
+directory resumes: a ZIP archive is missing its central directory then and
+has to be exported again.
+
+Usage:
+    python export_contracts.py payments.csv --out contracts/
+    python export_contracts.py payments.jsonl --out contracts.zip --preset palette --workers 8
+"""
+import argparse
+import csv
+import json
+import os
+import signal
+import sys
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import app
+
+def read_payments(path, input_format=None):
+    """
+    Streams payments from a CSV (header row required) or JSONL file
+
+    Yields:
+        tuple: (row number starting at 1, payment dict or None, parse error or None)
+    """
+    input_format = input_format or ('csv' if path.lower().endswith('.csv') else 'jsonl')
+    with open(path, newline='', encoding='utf-8') as f:
+        if input_format == 'csv':
+            for row_number, row in enumerate(csv.DictReader(f), start=1):
+                # Empty cells count as missing, like absent query parameters
+                yield row_number, {k: v for k, v in row.items() if k and v not in (None, '')}, None
+        else:
+            for row_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield row_number, json.loads(line), None
+                except json.JSONDecodeError as e:
+                    yield row_number, None, f"Invalid JSON: {e}"
+
+def init_worker():
+    """Prepares a pool worker, Ctrl-C is left to the parent which drains the pool"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    app.warm_render_worker()
+
+def render_row(payment_data, tx_id, output, scale):
+    """Renders one payment in a pool worker"""
+    return app.create_contract_image(payment_data, tx_id=tx_id, output=output, scale=scale)
+
+class DirectoryWriter:
+    """Writes each image as a file in a directory"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.error_path = os.path.join(directory, 'errors.jsonl')
+
+    def exists(self, name):
+        return os.path.exists(os.path.join(self.directory, name))
+
+    def write(self, name, data):
+        path = os.path.join(self.directory, name)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+
+    def close(self):
+        pass
+
+class ZipWriter:
+    """Appends each image to a ZIP archive, images are stored without recompression"""
+
+    def __init__(self, path, resume):
+        mode = 'a' if resume and os.path.exists(path) else 'w'
+        # Only a closed archive has a central directory, a hard kill leaves none.
+        # Mode 'a' would silently start a second archive after the partial one.
+        if mode == 'a' and not zipfile.is_zipfile(path):
+            raise SystemExit(f"{path} was not closed cleanly and cannot be resumed, remove it and start again")
+        self.archive = zipfile.ZipFile(path, mode, compression=zipfile.ZIP_STORED)
+        self.names = set(self.archive.namelist())
+        self.error_path = path + '.errors.jsonl'
+
+    def exists(self, name):
+        return name in self.names
+
+    def write(self, name, data):
+        self.archive.writestr(name, data)
+        self.names.add(name)
+
+    def close(self):
+        self.archive.close()
+
+class Progress:
+    """Prints progress and throughput to stderr at a fixed interval"""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.started = time.monotonic()
+        self.last_report = self.started
+        self.rendered = 0
+        self.skipped = 0
+        self.failed = 0
+
+    def tick(self, force=False):
+        now = time.monotonic()
+        if not force and now - self.last_report < self.interval:
+            return
+        self.last_report = now
+        elapsed = now - self.started
+        rate = self.rendered / elapsed if elapsed else 0.0
+        print(f"rendered {self.rendered}  skipped {self.skipped}  failed {self.failed}  "
+              f"{rate:.1f}/s  {elapsed:.0f}s", file=sys.stderr)
+
+def export(args):
+    output = app.output_options(preset=args.preset, image_format=args.image_format)
+    scale = app.render_scale(size=args.size, scale=args.scale)
+    extension = app.OUTPUT_FORMATS[output['format']][1]
+
+    if args.out.lower().endswith('.zip'):
+        writer = ZipWriter(args.out, args.resume)
+    else:
+        writer = DirectoryWriter(args.out)
+
+    progress = Progress(args.progress_every)
+    in_flight = deque()
+    max_in_flight = args.workers * 4
+
+    # Rewritten on every run, a resumed run checks every row again and records the failures that remain
+    with open(writer.error_path, 'w', encoding='utf-8') as errors, \
+            ProcessPoolExecutor(args.workers, initializer=init_worker) as pool:
+
+        def record_error(row_number, message):
+            progress.failed += 1
+            errors.write(json.dumps({"row": row_number, "error": message}) + '\n')
+
+        def finish_oldest(interrupted=False):
+            row_number, name, future = in_flight.popleft()
+            try:
+                writer.write(name, future.result())
+            except Exception as e:
+                record_error(row_number, str(e))
+            except BaseException as e:
+                # A render that was interrupted too, record it so the drain goes on
+                if not interrupted:
+                    raise
+                record_error(row_number, repr(e))
+            else:
+                progress.rendered += 1
+            progress.tick()
+
+        try:
+            for row_number, payment_data, error in read_payments(args.input, args.input_format):
+                if error is None:
+                    try:
+                        payment = app.PaymentRequest.parse(payment_data)
+                    except ValueError as e:
+                        error = str(e)
+                if error is not None:
+                    record_error(row_number, error)
+                    continue
+
+                # Names follow the input row so a resumed run finds them again
+                name = f"contract_{row_number:07d}.{extension}"
+                if args.resume and writer.exists(name):
+                    progress.skipped += 1
+                    continue
+
+                # The transaction ID derives from the payload, as on the server
+                tx_id = app.payment_tx_id(payment)
+
+                in_flight.append((row_number, name, pool.submit(render_row, payment.to_dict(), tx_id, output, scale)))
+                if len(in_flight) >= max_in_flight:
+                    finish_oldest()
+
+            while in_flight:
+                finish_oldest()
+        except KeyboardInterrupt:
+            # Keep what is finished so the archive stays valid for --resume
+            print("Interrupted, finishing renders in flight", file=sys.stderr)
+            while in_flight:
+                finish_oldest(interrupted=True)
+            return 130
+        finally:
+            writer.close()
+            progress.tick(force=True)
+
+    return 1 if progress.failed else 0
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render contract images from a CSV or JSONL file of payments")
+    parser.add_argument('input', help="CSV with a header row, or JSONL with one payment object per line")
+    parser.add_argument('--out', required=True, help="output directory, or a path ending in .zip")
+    parser.add_argument('--input-format', choices=('csv', 'jsonl'), help="default: from the file extension")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="render processes")
+    parser.add_argument('--preset', help=f"encoder preset: {', '.join(app.OUTPUT_PRESETS)}")
+    parser.add_argument('--image-format', help="png, webp or jpeg")
+    parser.add_argument('--size', help=f"size preset ({', '.join(app.SIZE_PRESETS)}) or width in pixels")
+    parser.add_argument('--scale', type=float, help="render scale relative to 900x600")
+    parser.add_argument('--resume', action='store_true', help="skip rows whose image was already written")
+    parser.add_argument('--progress-every', type=float, default=5.0, help="seconds between progress lines")
+    args = parser.parse_args(argv)
+
+    try:
+        return export(args)
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == '__main__':
+    sys.exit(main())
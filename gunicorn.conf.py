@@ -0,0 +1,39 @@
+"""
+Gunicorn settings for the contract API
+
+gunicorn picks this file up from the working directory, so 'gunicorn app:app'
+uses it without extra flags. By default the app is loaded and warmed up once
+in the master before the workers fork: fonts, Pillow plugins, static templates
+and a throwaway render are then shared copy-on-write and no worker pays for
+them on its first request. With GUNICORN_PRELOAD=false each worker warms up on
+its own before it accepts requests, which allows code reloads on HUP at the
+cost of more memory. Workers, bind address and timeouts keep their usual
+gunicorn settings (WEB_CONCURRENCY, PORT, GUNICORN_CMD_ARGS).
+"""
+import gc
+import os
+
+preload_app = os.environ.get('GUNICORN_PRELOAD', 'true').lower() == 'true'
+
+def when_ready(server):
+    """Runs in the master once it listens, before the first worker is forked"""
+    if not preload_app:
+        return
+    import app
+    seconds = app.warm_up()
+    # Keep the collector from touching the warmed objects, so their pages stay shared after fork
+    gc.freeze()
+    server.log.info("Warmed up in %.3fs before forking workers", seconds)
+
+def post_fork(server, worker):
+    import app
+    app.reset_after_fork()
+
+def post_worker_init(worker):
+    """Runs in each worker after the app is loaded, before it accepts requests"""
+    import app
+    if app.startup_state['preloaded']:
+        app.mark_ready()
+    else:
+        app.warm_up()
+    worker.log.info("Worker %s ready in %.3fs", worker.pid, app.startup_state['ready_seconds'])
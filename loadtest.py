@@ -0,0 +1,419 @@
+"""
+Load test and saturation report for the contract API
+
+Replays a weighted mix of /generate-contract GET, POST and download requests
+plus /health probes at increasing concurrency, and reports throughput, tail
+latency and error rate per step together with the point where adding clients
+stops adding throughput. Each worker/executor configuration is measured on
+its own, either in-process through the Flask test client or against a local
+gunicorn started on the loopback interface.
+
+Usage:
+    python loadtest.py                                      # in-process, current executor
+    python loadtest.py --executors inline,thread,process --workers 2,4
+    python loadtest.py --target gunicorn --workers 1,2,4 --save load.json
+    python loadtest.py --target url --url http://127.0.0.1:8000
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import urlencode, urlsplit
+
+import app
+from benchmark import percentile
+
+DEFAULT_MIX = 'get=6,post=2,download=1,health=1'
+
+# Payloads reused by the hot share of render requests, the rest are unique
+HOT_PAYMENTS = 16
+
+def parse_mix(text):
+    """
+    Parses a request mix like 'get=6,post=2,download=1,health=1'
+
+    Returns:
+        tuple: (request kinds, matching weights)
+    """
+    kinds, weights = [], []
+    for part in text.split(','):
+        kind, _, weight = part.partition('=')
+        kind = kind.strip()
+        if kind not in ('get', 'post', 'download', 'health'):
+            raise ValueError(f"Unknown request kind in mix: {kind!r}")
+        kinds.append(kind)
+        weights.append(float(weight or 1))
+    if not any(weights):
+        raise ValueError("Request mix needs at least one non-zero weight")
+    return kinds, weights
+
+def parse_list(text, cast=str):
+    return [cast(item.strip()) for item in text.split(',') if item.strip()]
+
+def payment_for(number):
+    """Returns a distinct, valid payment for every number"""
+    currencies = list(app.CURRENCIES) + ['doge']
+    timestamp = datetime(2024, 1, 1) + timedelta(seconds=number % (365 * 86400))
+    return {
+        'amount': round(0.01 * (number + 1), 2),
+        'sender': f"0x{number:040x}",
+        'receiver': f"0x{number * 7919:040x}",
+        'currency': currencies[number % len(currencies)],
+        'timestamp': timestamp.isoformat() + 'Z',
+    }
+
+class RequestMix:
+    """Picks the next request to send, weighted by kind"""
+
+    def __init__(self, kinds, weights, hot_ratio, seed):
+        self.kinds = kinds
+        self.weights = weights
+        self.hot_ratio = hot_ratio
+        self.rng = random.Random(seed)
+        self.seed = seed
+        self.sent = 0
+
+    def next(self):
+        """
+        Returns:
+            tuple: (kind, method, path, JSON body or None, headers)
+        """
+        kind = self.rng.choices(self.kinds, self.weights)[0]
+        if kind == 'health':
+            return kind, 'GET', '/health', None, {}
+
+        if self.rng.random() < self.hot_ratio:
+            payment = payment_for(self.rng.randrange(HOT_PAYMENTS))
+        else:
+            # Offset by the seed so client threads never repeat each other
+            self.sent += 1
+            payment = payment_for(HOT_PAYMENTS + self.seed * 10_000_000 + self.sent)
+
+        if kind == 'post':
+            return kind, 'POST', '/generate-contract', json.dumps(payment).encode('utf-8'), {'Content-Type': 'application/json'}
+        query = urlencode(payment)
+        if kind == 'download':
+            return kind, 'GET', f"/generate-contract?{query}&download=true", None, {}
+        return kind, 'GET', f"/generate-contract?{query}", None, {}
+
+class InProcessClient:
+    """Sends requests through the Flask test client, without any socket"""
+
+    def __init__(self):
+        self.client = app.app.test_client()
+
+    def request(self, method, path, body, headers):
+        response = self.client.open(path, method=method, data=body, headers=headers)
+        return response.status_code, len(response.get_data())
+
+    def close(self):
+        pass
+
+class HTTPClient:
+    """Sends requests over one keep-alive connection to a local server"""
+
+    def __init__(self, host, port, timeout):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.connection = None
+
+    def request(self, method, path, body, headers):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Reconnect on the next request, the failure counts as an error
+            self.close()
+            raise
+        if response.getheader('Connection', '').lower() == 'close':
+            self.close()
+        return response.status, len(data)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def run_step(make_client, mix_args, concurrency, duration, warmup):
+    """
+    Runs closed-loop clients for a fixed time, each sending its next request as soon as the last one returns
+
+    Args:
+        make_client (callable): Returns a new client for each thread
+        mix_args (tuple): (kinds, weights, hot ratio) for RequestMix
+        concurrency (int): Client threads
+        duration (float): Measured seconds
+        warmup (float): Seconds run first without measuring
+
+    Returns:
+        dict: Throughput, latency percentiles in ms, error counts and per-kind counts
+    """
+    kinds, weights, hot_ratio = mix_args
+    started = time.monotonic()
+    measure_from = started + warmup
+    deadline = measure_from + duration
+    results = []
+    lock = threading.Lock()
+
+    def client_loop(index):
+        client = make_client()
+        mix = RequestMix(kinds, weights, hot_ratio, seed=concurrency * 1000 + index)
+        samples = []
+        try:
+            while True:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                kind, method, path, body, headers = mix.next()
+                t0 = time.perf_counter()
+                try:
+                    status, size = client.request(method, path, body, headers)
+                except Exception:
+                    status, size = 0, 0
+                elapsed = time.perf_counter() - t0
+                if now >= measure_from:
+                    samples.append((kind, status, elapsed, size))
+        finally:
+            client.close()
+        with lock:
+            results.extend(samples)
+
+    threads = [threading.Thread(target=client_loop, args=(index,), daemon=True) for index in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    latencies = sorted(elapsed for _, _, elapsed, _ in results)
+    errors = [status for _, status, _, _ in results if status == 0 or status >= 400]
+    by_kind = {}
+    for kind, status, elapsed, _ in results:
+        by_kind.setdefault(kind, []).append(elapsed)
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "per_second": round(len(results) / duration, 1),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+        "error_rate": round(len(errors) / len(results), 4) if results else 0.0,
+        "busy": sum(1 for status in errors if status in (503, 504)),
+        "failed": sum(1 for status in errors if status == 0),
+        "render_bytes": sum(size for kind, _, _, size in results if kind != 'health'),
+        "kinds": {kind: {"requests": len(values), "p95_ms": round(percentile(sorted(values), 95) * 1000, 2)}
+                  for kind, values in sorted(by_kind.items())},
+    }
+
+def find_saturation(steps, min_gain, max_error_rate, p99_slo_ms):
+    """
+    Finds the concurrency after which the server is saturated
+
+    A step saturates when its error rate or p99 is over the limit, or when its
+    throughput is less than min_gain above the best throughput seen so far.
+
+    Returns:
+        dict: The last healthy step before saturation ('knee') and the first saturated one, or None if none saturated
+    """
+    knee = None
+    for step in steps:
+        over_limit = step['error_rate'] > max_error_rate or (p99_slo_ms and step['p99_ms'] > p99_slo_ms)
+        no_gain = knee is not None and step['per_second'] < knee['per_second'] * (1 + min_gain)
+        if over_limit or no_gain:
+            reason = 'errors' if step['error_rate'] > max_error_rate else 'p99' if over_limit else 'throughput'
+            return {"knee": knee, "saturated_at": step['concurrency'], "reason": reason}
+        knee = step
+    return {"knee": knee, "saturated_at": None, "reason": None}
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def wait_until_ready(host, port, timeout, process=None):
+    """Polls /health until the server answers 200"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process is not None and process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode} before becoming ready")
+        client = HTTPClient(host, port, timeout=2)
+        try:
+            if client.request('GET', '/health', None, {})[0] == 200:
+                return
+        except (OSError, http.client.HTTPException):
+            pass
+        finally:
+            client.close()
+        time.sleep(0.2)
+    raise RuntimeError(f"Server on {host}:{port} not ready after {timeout:g}s")
+
+def start_gunicorn(workers, executor, threads, render_workers):
+    """
+    Starts 'gunicorn app:app' on a free loopback port with the given configuration
+
+    Returns:
+        tuple: (process, port)
+    """
+    port = free_port()
+    env = dict(os.environ, RENDER_EXECUTOR=executor)
+    if render_workers:
+        env['RENDER_WORKERS'] = str(render_workers)
+    command = [sys.executable, '-m', 'gunicorn', 'app:app',
+               '--bind', f"127.0.0.1:{port}", '--workers', str(workers), '--threads', str(threads),
+               '--log-level', 'warning', '--timeout', '120']
+    process = subprocess.Popen(command, env=env, cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        wait_until_ready('127.0.0.1', port, timeout=60, process=process)
+    except Exception:
+        stop_process(process)
+        raise
+    return process, port
+
+def stop_process(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def configurations(args):
+    """Yields (name, settings) for every worker/executor combination to measure"""
+    for executor in parse_list(args.executors or app.RENDER_EXECUTOR):
+        if executor not in ('inline', 'thread', 'process'):
+            raise ValueError(f"Unknown executor: {executor}")
+        if args.target == 'url':
+            yield 'url', {}
+            return
+        for workers in parse_list(args.workers or str(app.RENDER_WORKERS), int):
+            if args.target == 'gunicorn':
+                name = f"gunicorn w={workers} t={args.threads} executor={executor}"
+            else:
+                name = f"inprocess executor={executor} render_workers={workers}"
+            yield name, {"executor": executor, "workers": workers}
+            if args.target == 'inprocess' and executor == 'inline':
+                # Inline rendering has no pool, so the worker count makes no difference
+                break
+
+def measure_configuration(args, name, settings, mix_args):
+    """Runs the concurrency ladder against one configuration and returns its steps"""
+    process = None
+    previous_executor = app.render_executor
+    if args.target == 'inprocess':
+        executor = app.RenderExecutor(settings['executor'], settings['workers'], args.queue_size or settings['workers'] * 4)
+        app.render_executor = executor
+        app.render_cache.clear()
+        make_client = InProcessClient
+    elif args.target == 'gunicorn':
+        process, port = start_gunicorn(settings['workers'], settings['executor'], args.threads, args.render_workers)
+        make_client = lambda: HTTPClient('127.0.0.1', port, args.request_timeout)
+    else:
+        url = urlsplit(args.url)
+        if url.hostname not in ('127.0.0.1', 'localhost', '::1'):
+            raise ValueError("Only loopback URLs are supported")
+        port = url.port or 80
+        wait_until_ready(url.hostname, port, timeout=10)
+        make_client = lambda: HTTPClient(url.hostname, port, args.request_timeout)
+
+    steps = []
+    try:
+        for concurrency in parse_list(args.concurrency, int):
+            step = run_step(make_client, mix_args, concurrency, args.duration, args.warmup)
+            steps.append(step)
+            print(f"{name:<44} {format_step(step)}", file=sys.stderr)
+            if args.stop_on_saturation and find_saturation(steps, args.min_gain, args.max_error_rate, args.p99_slo)['saturated_at']:
+                break
+    finally:
+        if process is not None:
+            stop_process(process)
+        if args.target == 'inprocess':
+            app.render_executor.shutdown()
+            app.render_executor = previous_executor
+    return steps
+
+def format_step(step):
+    return (f"c={step['concurrency']:<4} {step['per_second']:>8.1f}/s  p50 {step['p50_ms']:>8.2f}ms  "
+            f"p95 {step['p95_ms']:>8.2f}ms  p99 {step['p99_ms']:>8.2f}ms  "
+            f"errors {step['error_rate']:>6.1%}  busy {step['busy']}")
+
+def format_saturation(name, saturation):
+    knee = saturation['knee']
+    if knee is None:
+        return f"{name:<44} saturated at the first step ({saturation['reason']})"
+    best = f"best {knee['per_second']:.1f}/s at c={knee['concurrency']} (p99 {knee['p99_ms']:.1f}ms)"
+    if saturation['saturated_at'] is None:
+        return f"{name:<44} {best}, not saturated, try higher concurrency"
+    return f"{name:<44} {best}, saturates at c={saturation['saturated_at']} ({saturation['reason']})"
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Load test the contract API and find its saturation point")
+    parser.add_argument('--target', choices=('inprocess', 'gunicorn', 'url'), default='inprocess',
+                        help="Flask test client, a gunicorn started per configuration, or a running server")
+    parser.add_argument('--url', default='http://127.0.0.1:8000', help="loopback server for --target url")
+    parser.add_argument('--workers', help="comma-separated gunicorn workers, or render pool workers in-process")
+    parser.add_argument('--executors', help="comma-separated render executors (inline, thread, process)")
+    parser.add_argument('--threads', type=int, default=1, help="gunicorn threads per worker")
+    parser.add_argument('--render-workers', type=int, help="RENDER_WORKERS for gunicorn workers")
+    parser.add_argument('--queue-size', type=int, help="render queue size in-process (default: 4 per worker)")
+    parser.add_argument('--concurrency', default='1,2,4,8,16,32', help="comma-separated client counts")
+    parser.add_argument('--duration', type=float, default=10.0, help="measured seconds per step")
+    parser.add_argument('--warmup', type=float, default=1.0, help="unmeasured seconds before each step")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"request kinds and weights (default {DEFAULT_MIX})")
+    parser.add_argument('--hot-ratio', type=float, default=0.0,
+                        help=f"share of renders reusing one of {HOT_PAYMENTS} repeated payloads")
+    parser.add_argument('--request-timeout', type=float, default=60.0, help="HTTP client timeout in seconds")
+    parser.add_argument('--min-gain', type=float, default=0.1,
+                        help="throughput growth a step must add to not count as saturated (default 0.1 = 10%%)")
+    parser.add_argument('--max-error-rate', type=float, default=0.01, help="error rate that counts as saturated")
+    parser.add_argument('--p99-slo', type=float, help="p99 in ms that counts as saturated")
+    parser.add_argument('--stop-on-saturation', action='store_true', help="skip higher steps once saturated")
+    parser.add_argument('--save', metavar='PATH', help="write the results as JSON")
+    args = parser.parse_args(argv)
+
+    try:
+        kinds, weights = parse_mix(args.mix)
+        configs = list(configurations(args))
+    except ValueError as e:
+        parser.error(str(e))
+    mix_args = (kinds, weights, args.hot_ratio)
+
+    report = {
+        "meta": {
+            "created": datetime.now().isoformat(),
+            "target": args.target,
+            "mix": args.mix,
+            "hot_ratio": args.hot_ratio,
+            "duration": args.duration,
+            "cpus": os.cpu_count(),
+        },
+        "configurations": {},
+    }
+    for name, settings in configs:
+        steps = measure_configuration(args, name, settings, mix_args)
+        saturation = find_saturation(steps, args.min_gain, args.max_error_rate, args.p99_slo)
+        report["configurations"][name] = {"settings": settings, "steps": steps, "saturation": saturation}
+
+    print("", file=sys.stderr)
+    for name, result in report["configurations"].items():
+        print(format_saturation(name, result['saturation']), file=sys.stderr)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print(f"Results written to {args.save}", file=sys.stderr)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())